@@ -0,0 +1,93 @@
+# Domoticz Home Automation - Plugin Tinkerforge LCD 20x4 Bricklet
+# Stub of the Domoticz Python plugin framework module to run plugin.py without Domoticz.
+# Used by the benchmark (bench.py). Log messages are collected in LOG, the Devices and Parameters
+# dictionaries are assigned to the plugin module by the benchmark.
+
+import time
+
+# Log messages as tuple (time, level, text). Level: Log, Error, Debug.
+LOG = []
+# Print the log messages
+VERBOSE = False
+DEBUGGING = 0
+HEARTBEAT = 10
+
+Devices = {}
+Parameters = {}
+
+def _log(level, text):
+    LOG.append((time.time(), level, text))
+    if VERBOSE:
+        print("%s: %s" % (level, text))
+
+def Log(text):
+    _log("Log", text)
+
+def Error(text):
+    _log("Error", text)
+
+def Debug(text):
+    if DEBUGGING:
+        _log("Debug", text)
+
+def Debugging(level):
+    global DEBUGGING
+    DEBUGGING = level
+
+def Heartbeat(seconds):
+    global HEARTBEAT
+    HEARTBEAT = seconds
+
+class Device:
+
+    def __init__(self, Name="", Unit=0, TypeName="", Type=0, Subtype=0, Switchtype=0, Image=0, Options=None, Used=0, DeviceID=""):
+        self.Name = Name
+        self.Unit = Unit
+        self.TypeName = TypeName
+        self.Switchtype = Switchtype
+        self.Used = Used
+        self.ID = Unit
+        self.nValue = 0
+        self.sValue = ""
+        self.LastLevel = 0
+        # Number of Update calls
+        self.Updates = 0
+
+    def Create(self):
+        Devices[self.Unit] = self
+
+    def Update(self, nValue=0, sValue="", **kwargs):
+        self.nValue = nValue
+        self.sValue = sValue
+        self.Updates += 1
+
+    def __str__(self):
+        return "Unit=%d,Name=%s,nValue=%d,sValue=%s" % (self.Unit, self.Name, self.nValue, self.sValue)
+
+class Connection:
+    # Connection stub, never connects
+
+    def __init__(self, Name="", Transport="", Protocol="", Address="", Port="", Baud=0):
+        self.Name = Name
+        self.Transport = Transport
+        self.Protocol = Protocol
+        self.Address = Address
+        self.Port = Port
+
+    def Connect(self):
+        pass
+
+    def Listen(self):
+        pass
+
+    def Connected(self):
+        return False
+
+    def Connecting(self):
+        return False
+
+    def Send(self, Message, Delay=0):
+        pass
+
+    def Disconnect(self):
+        pass
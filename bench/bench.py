@@ -0,0 +1,232 @@
+# Domoticz Home Automation - Plugin Tinkerforge LCD 20x4 Bricklet
+# Offline benchmark of the plugin write path.
+# The plugin runs with the Domoticz stub (Domoticz.py) against a fake brickd (fake_brickd.py), i.e. no Raspberry Pi,
+# brickd or Domoticz is required. The Tinkerforge Python API bindings are required: pip3 install tinkerforge
+#
+# Workloads (scripted display updates, one frame = one update):
+# redraw - all 4 lines rewritten with new values (like tflcd20x4_rpi_monitor.lua every minute)
+# unchanged - all 4 lines rewritten with the same values
+# clocktick - the time at a fixed position changes (every minute)
+# clock - the time at a random line and position with clear display (like tflcd20x4_clock.lua)
+# marquee - screen template with a scrolling text, one heartbeat per frame
+#
+# Reported per workload: round trips (requests to brickd) per frame, bytes on the wire per frame and
+# the wall-clock latency percentiles from the update until the fake bricklet displays the frame.
+#
+# Usage:
+# python3 bench/bench.py [--frames 200] [--latency 2] [--rate 50] [--workload redraw clock] [--output bench_output.txt] [--baseline file]
+# The --output file (JSON) of a run can be used as --baseline of a later run to compare write path changes.
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+PLUGINDIR = os.path.dirname(BENCHDIR)
+sys.path.insert(0, BENCHDIR)
+sys.path.insert(0, PLUGINDIR)
+
+import Domoticz
+from fake_brickd import FakeBrickd
+import plugin
+
+UID = "BHN"
+# Max time (seconds) to wait for a frame to be displayed
+FRAMETIMEOUT = 10
+
+MARQUEESCREEN = [
+    {"name":"marquee","lines":[
+        {"line":0,"position":0,"clear":2,"text":"Domoticz"},
+        {"line":1,"position":0,"clear":0,"marquee":1,"text":"This is a long text scrolling on line 1 of the display"},
+        {"line":3,"position":15,"clear":0,"text":"{time:%H:%M}"}
+    ]}
+]
+
+"""
+Start a plugin instance connected to the fake brickd.
+Parameter:
+brickd - FakeBrickd
+screenfile - screen templates file or None
+rate - max bricklet calls per second, 0=unlimited
+"""
+def start_plugin(brickd, screenfile=None, rate=0):
+    Domoticz.Devices.clear()
+    Domoticz.Parameters.clear()
+    Domoticz.Parameters.update({"Address": brickd.host, "Port": str(brickd.port), "Mode1": UID, "Mode4": str(rate), "Mode5": "10", "Mode6": "Normal",
+        "HomeFolder": PLUGINDIR + os.sep})
+    plugin.Devices = Domoticz.Devices
+    plugin.Parameters = Domoticz.Parameters
+    plugin.CUSTOMCHARFILE = os.path.join(PLUGINDIR, "customchar.json")
+    plugin.SCREENFILE = screenfile or os.path.join(BENCHDIR, "noscreens.json")
+    # Each run starts without the display state of a previous run
+    plugin.STATEFILE = os.path.join(tempfile.gettempdir(), "tflcd20x4_bench_state.json")
+    if os.path.exists(plugin.STATEFILE):
+        os.remove(plugin.STATEFILE)
+    plugin._plugin = plugin.BasePlugin()
+    plugin.onStart()
+    wait_quiet(brickd)
+    return plugin._plugin
+
+"""
+Wait until the fake brickd received no requests for the quiet time (seconds).
+"""
+def wait_quiet(brickd, quiet=0.2):
+    last = -1
+    while True:
+        requests = brickd.get_stats()["requests"]
+        if requests == last:
+            return
+        last = requests
+        time.sleep(quiet)
+
+"""
+Check if the fake bricklet displays the frame requested by the plugin. Unknown cells (None) are not checked.
+"""
+def is_displayed(brickd, p):
+    text = brickd.get_lcd(plugin_uid()).get_text()
+    for line, row in enumerate(p.displays[0].frame):
+        for column, cell in enumerate(row):
+            if cell is not None and text[line][column] != cell:
+                return False
+    return True
+
+def plugin_uid():
+    from tinkerforge.ip_connection import base58decode
+    return base58decode(UID)
+
+def write_json(p, jsonstring):
+    Domoticz.Devices[plugin.UNITJSON].sValue = jsonstring
+    plugin.onDeviceModified(plugin.UNITJSON)
+
+def lines_json(texts, position=0, clear=1):
+    return json.dumps([{"line": line, "position": position, "clear": clear, "text": text} for line, text in enumerate(texts)])
+
+"""
+Workloads: function(plugin, frame number) making a display update.
+"""
+def workload_redraw(p, i):
+    write_json(p, lines_json(["CPU %.1f °C" % (random.uniform(40, 60)), "RAM %.2f %%" % (random.uniform(20, 40)),
+        "DISC %.2f %%" % (random.uniform(60, 70)), "\u0009%02d:%02d" % ((i // 60) % 24, i % 60)]))
+
+def workload_unchanged(p, i):
+    write_json(p, lines_json(["CPU 44.0 °C", "RAM 29.18 %", "DISC 69.08 %", "\u000910:44"]))
+
+def workload_clocktick(p, i):
+    write_json(p, json.dumps([{"line": 0, "position": 14, "clear": 0, "text": "\u0009%02d:%02d" % ((i // 60) % 24, i % 60)}]))
+
+def workload_clock(p, i):
+    write_json(p, json.dumps([{"line": random.randint(0, 3), "position": random.randint(0, 14), "clear": 2,
+        "text": "\u0009%02d:%02d" % ((i // 60) % 24, i % 60)}]))
+
+def workload_marquee(p, i):
+    plugin.onHeartbeat()
+
+WORKLOADS = {
+    "redraw": workload_redraw,
+    "unchanged": workload_unchanged,
+    "clocktick": workload_clocktick,
+    "clock": workload_clock,
+    "marquee": workload_marquee,
+}
+
+def percentile(values, p):
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(round(p / 100.0 * (len(values) - 1))), len(values) - 1)]
+
+"""
+Run a workload and return the result as dict.
+"""
+def run_workload(name, frames, latency, rate):
+    brickd = FakeBrickd(latency=latency)
+    screenfile = None
+    if name == "marquee":
+        handle, screenfile = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(handle, "w") as f:
+            json.dump(MARQUEESCREEN, f)
+    try:
+        p = start_plugin(brickd, screenfile, rate)
+        brickd.reset_stats()
+        workload = WORKLOADS[name]
+        latencies = []
+        requests = []
+        start = time.perf_counter()
+        for i in range(frames):
+            before = brickd.get_stats()["requests"]
+            t0 = time.perf_counter()
+            workload(p, i)
+            while not is_displayed(brickd, p):
+                if time.perf_counter() - t0 > FRAMETIMEOUT:
+                    raise RuntimeError("Workload %s: frame %d not displayed" % (name, i))
+                time.sleep(0.0002)
+            latencies.append(time.perf_counter() - t0)
+            # Writes not changing the display (i.e. of a redundant write path) are counted with the next frame
+            requests.append(brickd.get_stats()["requests"] - before)
+        elapsed = time.perf_counter() - start
+        wait_quiet(brickd)
+        stats = brickd.get_stats()
+        plugin.onStop()
+    finally:
+        brickd.close()
+        if screenfile is not None:
+            os.remove(screenfile)
+    return {
+        "workload": name,
+        "frames": frames,
+        "latencyBrickd": latency,
+        "roundTripsPerFrame": stats["requests"] / float(frames),
+        "maxRoundTripsPerFrame": max(requests),
+        "bytesPerFrame": (stats["bytesIn"] + stats["bytesOut"]) / float(frames),
+        "latencyP50": percentile(latencies, 50),
+        "latencyP90": percentile(latencies, 90),
+        "latencyP99": percentile(latencies, 99),
+        "latencyMax": max(latencies),
+        "framesPerSecond": frames / elapsed,
+        "calls": stats["calls"],
+    }
+
+def print_result(result, baseline=None):
+    print("%-10s frames=%d round trips/frame=%.2f bytes/frame=%.1f latency p50=%.2fms p90=%.2fms p99=%.2fms max=%.2fms" % (
+        result["workload"], result["frames"], result["roundTripsPerFrame"], result["bytesPerFrame"],
+        result["latencyP50"] * 1000, result["latencyP90"] * 1000, result["latencyP99"] * 1000, result["latencyMax"] * 1000))
+    print("%-10s calls=%s" % ("", json.dumps(result["calls"], sort_keys=True)))
+    if baseline is not None:
+        deltas = []
+        for key in ("roundTripsPerFrame", "bytesPerFrame", "latencyP50", "latencyP99"):
+            if baseline.get(key):
+                deltas.append("%s %+.1f%%" % (key, (result[key] - baseline[key]) / baseline[key] * 100))
+        print("%-10s vs baseline: %s" % ("", ", ".join(deltas)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the LCD 20x4 plugin write path against a fake brickd.")
+    parser.add_argument("--frames", type=int, default=200, help="frames per workload")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake brickd response latency in milliseconds")
+    parser.add_argument("--rate", type=float, default=0, help="max bricklet calls per second (Max Calls/s), default 0=unlimited")
+    parser.add_argument("--workload", nargs="*", choices=sorted(WORKLOADS.keys()), help="workloads to run (default all)")
+    parser.add_argument("--output", help="write the results as JSON to the file")
+    parser.add_argument("--baseline", help="compare with the results (JSON) of a previous run")
+    parser.add_argument("--seed", type=int, default=1, help="random seed of the workloads")
+    parser.add_argument("--verbose", action="store_true", help="print the plugin log")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    Domoticz.VERBOSE = args.verbose
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {result["workload"]: result for result in json.load(f)}
+    results = []
+    for name in args.workload or sorted(WORKLOADS.keys()):
+        result = run_workload(name, args.frames, args.latency / 1000.0, args.rate)
+        print_result(result, baseline.get(name))
+        results.append(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == "__main__":
+    main()
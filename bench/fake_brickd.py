@@ -0,0 +1,187 @@
+# Domoticz Home Automation - Plugin Tinkerforge LCD 20x4 Bricklet
+# Fake Brick Daemon (brickd) speaking the Tinkerforge TCP/IP protocol for LCD 20x4 Bricklets.
+# Used by the benchmark (bench.py) to run plugin.py without a Master Brick and bricklet.
+# The display content, config and custom characters are kept per bricklet UID.
+# The requests, function calls and bytes on the wire are counted. A latency can be set to simulate a slow brickd.
+
+import socket
+import struct
+import threading
+import time
+
+# Packet header: uid, length, function id, sequence number and options, flags
+HEADER = struct.Struct("<IBBBB")
+# Option bit response expected
+RESPONSEEXPECTED = 0x08
+
+# LCD 20x4 Bricklet
+DEVICEIDENTIFIER = 212
+FUNCTIONS = {
+    1: "write_line",
+    2: "clear_display",
+    3: "backlight_on",
+    4: "backlight_off",
+    5: "is_backlight_on",
+    6: "set_config",
+    7: "get_config",
+    8: "is_button_pressed",
+    11: "set_custom_character",
+    12: "get_custom_character",
+    13: "set_default_text",
+    14: "get_default_text",
+    15: "set_default_text_counter",
+    16: "get_default_text_counter",
+    128: "disconnect_probe",
+    254: "enumerate",
+    255: "get_identity",
+}
+
+BASE58 = "123456789abcdefghijkmnopqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ"
+
+def base58encode(value):
+    encoded = ""
+    while value >= 58:
+        value, mod = divmod(value, 58)
+        encoded = BASE58[mod] + encoded
+    return BASE58[value] + encoded
+
+# State of a fake LCD 20x4 Bricklet
+class FakeLCD:
+
+    def __init__(self):
+        self.lines = [bytearray(b" " * 20) for line in range(4)]
+        self.backlight = False
+        self.cursor = False
+        self.blinking = False
+        self.chars = {}
+        self.buttons = [False] * 4
+
+    # Display content as list of 4 strings (LCD charset decoded as latin-1)
+    def get_text(self):
+        return [bytes(line).decode("latin-1") for line in self.lines]
+
+class FakeBrickd:
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.host = host
+        # Latency (seconds) added to each response
+        self.latency = latency
+        self.lock = threading.Lock()
+        # Bricklets by numeric UID
+        self.lcds = {}
+        self.clients = []
+        self.running = True
+        self.reset_stats()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(4)
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self.accept, name="FakeBrickd", daemon=True).start()
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = 0
+            self.responses = 0
+            self.bytesIn = 0
+            self.bytesOut = 0
+            self.calls = {}
+
+    # Get the statistics as dict
+    def get_stats(self):
+        with self.lock:
+            return {"requests": self.requests, "responses": self.responses, "bytesIn": self.bytesIn,
+                    "bytesOut": self.bytesOut, "calls": dict(self.calls)}
+
+    # Get the fake bricklet, created if not exists
+    def get_lcd(self, uid):
+        with self.lock:
+            return self.lcds.setdefault(uid, FakeLCD())
+
+    def accept(self):
+        while self.running:
+            try:
+                client, address = self.server.accept()
+            except OSError:
+                return
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.clients.append(client)
+            threading.Thread(target=self.serve, args=(client,), name="FakeBrickdClient", daemon=True).start()
+
+    def receive(self, client, length):
+        data = b""
+        while len(data) < length:
+            chunk = client.recv(length - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+
+    def serve(self, client):
+        try:
+            while True:
+                header = self.receive(client, HEADER.size)
+                uid, length, function_id, options, flags = HEADER.unpack(header)
+                payload = self.receive(client, length - HEADER.size)
+                with self.lock:
+                    self.requests += 1
+                    self.bytesIn += length
+                    name = FUNCTIONS.get(function_id, str(function_id))
+                    self.calls[name] = self.calls.get(name, 0) + 1
+                    lcd = self.lcds.setdefault(uid, FakeLCD())
+                    response = self.handle(uid, lcd, function_id, payload)
+                if options & RESPONSEEXPECTED:
+                    if self.latency > 0:
+                        time.sleep(self.latency)
+                    data = response or b""
+                    packet = HEADER.pack(uid, HEADER.size + len(data), function_id, options, 0) + data
+                    with self.lock:
+                        self.responses += 1
+                        self.bytesOut += len(packet)
+                    client.sendall(packet)
+        except (EOFError, OSError):
+            pass
+
+    # Handle a request, return the response payload or None
+    def handle(self, uid, lcd, function_id, payload):
+        if function_id == 1:
+            line, position = payload[0], payload[1]
+            text = payload[2:22].split(b"\0")[0][:20 - position]
+            lcd.lines[line][position:position + len(text)] = text
+        elif function_id == 2:
+            lcd.lines = [bytearray(b" " * 20) for line in range(4)]
+        elif function_id == 3:
+            lcd.backlight = True
+        elif function_id == 4:
+            lcd.backlight = False
+        elif function_id == 5:
+            return struct.pack("<?", lcd.backlight)
+        elif function_id == 6:
+            lcd.cursor, lcd.blinking = bool(payload[0]), bool(payload[1])
+        elif function_id == 7:
+            return struct.pack("<??", lcd.cursor, lcd.blinking)
+        elif function_id == 8:
+            return struct.pack("<?", lcd.buttons[payload[0]])
+        elif function_id == 11:
+            lcd.chars[payload[0]] = tuple(payload[1:9])
+        elif function_id == 12:
+            return struct.pack("<8B", *lcd.chars.get(payload[0], (0,) * 8))
+        elif function_id == 255:
+            return struct.pack("<8s8sc3B3BH", base58encode(uid).encode(), b"6xb", b"b", 1, 2, 0, 2, 0, 6, DEVICEIDENTIFIER)
+        return None
+
+    # Stop the server and close the client connections, i.e. simulate a brickd restart
+    def close(self):
+        self.running = False
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server.close()
+        for client in self.clients:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+                client.close()
+            except OSError:
+                pass
+        self.clients = []
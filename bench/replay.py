@@ -0,0 +1,190 @@
+# Domoticz Home Automation - Plugin Tinkerforge LCD 20x4 Bricklet
+# Offline replay of a trace recorded by the plugin (Parameter Debug = Trace, file TRACEFILE).
+# The trace events (text device updates, switch commands, button presses) are pushed through the plugin
+# with the Domoticz stub (Domoticz.py) against a fake brickd (fake_brickd.py) at real speed or max speed.
+# The plugin heartbeat is called every second of the trace time.
+#
+# Checked and reported:
+# frame - the fake bricklets display the frames recorded when the traced plugin stopped (unknown cells and library glyphs are not checked)
+# calls - total bricklet calls (requests to brickd) and calls per function
+# throughput - events per second until all writers are idle (queues empty and last jobs written)
+#
+# Usage:
+# python3 bench/replay.py trace.jsonl [--speed 0] [--latency 2] [--rate 50] [--screens screens.json] [--output replay_output.txt] [--baseline file]
+# The --output file (JSON) of a run can be used as --baseline of a later run. The exit code is 1 if a frame differs
+# or the calls increased compared to the baseline, i.e. a trace is a regression test of the write path.
+
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHDIR)
+
+import Domoticz
+from fake_brickd import FakeBrickd
+import bench
+import plugin
+
+# Max time (seconds) to wait for the writers to be idle after the last event
+DRAINTIMEOUT = 30
+
+"""
+Load a trace file.
+Return:
+tuple (header dict, list of events [time, kind, ...])
+"""
+def load_trace(filename):
+    with open(filename) as f:
+        header = json.loads(f.readline())
+        events = [json.loads(line) for line in f if line.strip()]
+    if header.get("version") != 1:
+        raise ValueError("Trace %s: version %s not supported" % (filename, header.get("version")))
+    return header, events
+
+"""
+Push an event through the plugin.
+"""
+def replay_event(event):
+    kind = event[1]
+    if kind == "device":
+        unit, svalue = event[2:4]
+        if unit in Domoticz.Devices:
+            Domoticz.Devices[unit].sValue = svalue
+            plugin.onDeviceModified(unit)
+    elif kind == "command":
+        unit, command, level = event[2:5]
+        plugin.onCommand(unit, command, level, 0)
+    elif kind == "button":
+        display, button, state = event[2:5]
+        if state == 1:
+            plugin.onButtonPressedCallback(display, button)
+        else:
+            plugin.onButtonReleasedCallback(display, button)
+
+"""
+Wait until the writers of the displays are idle, i.e. the queues are empty and the last jobs are written.
+"""
+def wait_drained(p):
+    start = time.perf_counter()
+    while not all(display.lcdWriter.is_idle() for display in p.displays):
+        if time.perf_counter() - start > DRAINTIMEOUT:
+            raise RuntimeError("Writers not idle after %ds" % (DRAINTIMEOUT))
+        time.sleep(0.0002)
+
+"""
+Compare the display content of the fake bricklets with the recorded frames.
+Return:
+list of mismatches as text
+"""
+def check_frames(brickd, p, frames):
+    from tinkerforge.ip_connection import base58decode
+    mismatches = []
+    for index, lines in frames.items():
+        if index >= len(p.displays):
+            mismatches.append("display %d not replayed" % (index))
+            continue
+        text = brickd.get_lcd(base58decode(p.displays[index].uid)).get_text()
+        for line, row in enumerate(lines):
+            for column, cell in enumerate(row):
+                # Library glyphs are displayed as the custom character allocated, not checked
+                if cell != plugin.STATEUNKNOWNCELL and cell < chr(plugin.GLYPHVIRTUAL0) and text[line][column] != cell:
+                    mismatches.append("display %d line %d: %r expected %r" % (index, line, text[line], row))
+                    break
+    return mismatches
+
+"""
+Replay a trace and return the result as dict.
+Parameter:
+speed - 1=real speed, 2=twice as fast etc., 0=max speed
+"""
+def replay(filename, speed, latency, rate, screenfile):
+    header, events = load_trace(filename)
+    # The displays are connected to the fake brickd, i.e. the host and port of the UIDs are not used
+    bench.UID = ",".join(entry.split("@")[0].strip() for entry in header["uids"].split(","))
+    brickd = FakeBrickd(latency=latency)
+    try:
+        p = bench.start_plugin(brickd, screenfile, rate)
+        brickd.reset_stats()
+        frames = {}
+        heartbeat = 1
+        start = time.perf_counter()
+        for event in events:
+            # The heartbeats of the trace time passed
+            while heartbeat <= event[0]:
+                plugin.onHeartbeat()
+                heartbeat += 1
+            if speed > 0:
+                delay = start + event[0] / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            if event[1] == "frame":
+                frames[event[2]] = event[3]
+            else:
+                replay_event(event)
+        wait_drained(p)
+        elapsed = time.perf_counter() - start
+        bench.wait_quiet(brickd)
+        mismatches = check_frames(brickd, p, frames)
+        stats = brickd.get_stats()
+        plugin.onStop()
+    finally:
+        brickd.close()
+    inputs = len([event for event in events if event[1] != "frame"])
+    return {
+        "trace": os.path.basename(filename),
+        "events": inputs,
+        "traceDuration": events[-1][0] if len(events) > 0 else 0,
+        "speed": speed,
+        "latencyBrickd": latency,
+        "framesChecked": len(frames),
+        "mismatches": mismatches,
+        "totalCalls": stats["requests"],
+        "bytes": stats["bytesIn"] + stats["bytesOut"],
+        "elapsed": elapsed,
+        "eventsPerSecond": inputs / elapsed if elapsed > 0 else 0.0,
+        "calls": stats["calls"],
+    }
+
+def print_result(result, baseline=None):
+    print("%s events=%d duration=%.1fs frames checked=%d mismatches=%d total calls=%d bytes=%d elapsed=%.3fs events/s=%.1f" % (
+        result["trace"], result["events"], result["traceDuration"], result["framesChecked"], len(result["mismatches"]),
+        result["totalCalls"], result["bytes"], result["elapsed"], result["eventsPerSecond"]))
+    print("calls=%s" % (json.dumps(result["calls"], sort_keys=True)))
+    for mismatch in result["mismatches"]:
+        print("MISMATCH %s" % (mismatch))
+    if baseline is not None:
+        deltas = []
+        for key in ("totalCalls", "bytes", "eventsPerSecond"):
+            if baseline.get(key):
+                deltas.append("%s %+.1f%%" % (key, (result[key] - baseline[key]) / float(baseline[key]) * 100))
+        print("vs baseline: %s" % (", ".join(deltas)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a trace recorded by the LCD 20x4 plugin against a fake brickd.")
+    parser.add_argument("trace", help="trace file (JSON lines) recorded with Parameter Debug = Trace")
+    parser.add_argument("--speed", type=float, default=0, help="replay speed, 1=real speed, default 0=max speed")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake brickd response latency in milliseconds")
+    parser.add_argument("--rate", type=float, default=0, help="max bricklet calls per second (Max Calls/s), default 0=unlimited")
+    parser.add_argument("--screens", help="screen templates file of the traced plugin")
+    parser.add_argument("--output", help="write the result as JSON to the file")
+    parser.add_argument("--baseline", help="compare with the result (JSON) of a previous run")
+    parser.add_argument("--verbose", action="store_true", help="print the plugin log")
+    args = parser.parse_args()
+    Domoticz.VERBOSE = args.verbose
+    result = replay(args.trace, args.speed, args.latency / 1000.0, args.rate, args.screens)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_result(result, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=1)
+    failed = len(result["mismatches"]) > 0 or (baseline is not None and result["totalCalls"] > baseline["totalCalls"])
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
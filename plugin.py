@@ -1,6 +1,6 @@
 # Domoticz Home Automation - Plugin Tinkerforge LCD 20x4 Bricklet
 # @author Robert W.B. Linn
-# @version 0.8.0 (Build 20200215)
+# @version 1.1.0 (Build 20261018)
 #
 # NOTE: after every change restart Domoticz & check the Domoticz Log
 # sudo systemctl restart domoticz.service OR sudo service domoticz.sh restart
@@ -15,7 +15,7 @@
 
 
 """
-<plugin key="tflcd20x4" name="Tinkerforge LCD 20x4 Bricklet" author="rwbL" version="0.8.0">
+<plugin key="tflcd20x4" name="Tinkerforge LCD 20x4 Bricklet" author="rwbL" version="1.1.0">
     <description>
         <h2>Tinkerforge LCD 20x4 Bricklet</h2><br/>
         The plugin enables to write characters to the LCD 20x4 display via a Domoticz text device (Type:General, SubType:Text).<br/>
@@ -37,28 +37,46 @@
         <h3>Domoticz Devices</h3>
         <ul style="list-style-type:square">
             <li>Lines 0-3 JSON - Type:General, SubType:Text, Name:JSON (set text for up-to 4 LCD lines at any position using JSON array).</li>
-            <li>Backlight - Type:Light/Switch, SubType:Switch, SwitchType:On/Off, Name:Backlight (set the backlight on/off).</li>
+            <li>Backlight - Type:Light/Switch, SubType:Switch, SwitchType:On/Off, Name:Backlight (enable the backlight, switched off if idle or outside the schedule, see BACKLIGHTIDLE).</li>
             <li>Cursor - Type:Light/Switch, SubType:Switch, SwitchType:On/Off, Name:Cursor (set the cursor [underscore] on/off).</li>
             <li>Blinking - Type:Light/Switch, SubType:Switch, SwitchType:On/Off, Name:Blinking (set the cursor blinking on/off).</li>
             <li>Buttons - Type:Light/Switch, SubType:Switch, SwitchType:On/Off, Name:Button 0 -3 (set the buttons).</li>
-            <li>In total 8 Domoticz devices are created for the Tinkerforge LCD 20x4 bricklet.</li>
+            <li>Button Events - Type:Light/Switch, SubType:Switch, SwitchType:Push On, Name:Button 0-3 Long/Double/Repeat (long press, double press, hold repeat).</li>
+            <li>Metrics - Type:General, SubType:Text, Name:Metrics (optional, see Metrics Device).</li>
+            <li>In total 20 Domoticz devices are created per Tinkerforge LCD 20x4 bricklet. The units of display n (0-based) start at n*32+1.</li>
         </ul>
         <br/>
         <h3>Configuration</h3>
         <ul style="list-style-type:square">
             <li>Address: IP address of the host connected to. Default: 127.0.0.1 (for USB connection)</li>
             <li>Port: Port used by the host. Default: 4223</li>
-            <li>UID: Unique identifier of the LCD 20x4 Bricklet. Obtain the UID via the Brick Viewer. Default: BHN</li>
+            <li>UIDs: Unique identifier of the LCD 20x4 Bricklet. Obtain the UID via the Brick Viewer. Default: BHN<br/>
+            Several displays are separated by comma, optional with the brickd host and port, i.e. BHN,XYZ@192.168.1.20:4223. Max 7 displays.</li>
+            <li>Metrics Device: Create a text device with the write pipeline metrics (updated every 5 minutes). Default: False</li>
+            <li>Ingress Port: Local UDP and TCP port to receive the line items directly, bypassing the JSON text device. Empty=disabled. Default: empty</li>
+            <li>Max Calls/s: Max bricklet calls per second and display. Urgent changes (backlight, cursor, alert screens) are written first. 0=unlimited. Default: 50</li>
+            <li>Interval: Interval (seconds) to request device values, check the configuration files and log the status. Default: 10</li>
+            <li>Debug: Log debug messages. Trace: Log debug messages and record the JSON updates, commands and button presses to the trace file (see bench/replay.py). Default: True</li>
         </ul>
     </description>
     <params>
         <param field="Address" label="Host" width="200px" required="true" default="127.0.0.1"/>
         <param field="Port" label="Port" width="75px" required="true" default="4223"/>
-        <param field="Mode1" label="UID" width="200px" required="true" default="BHN"/>
+        <param field="Mode1" label="UIDs" width="300px" required="true" default="BHN"/>
+        <param field="Mode2" label="Metrics Device" width="75px">
+            <options>
+                <option label="True" value="True"/>
+                <option label="False" value="False" default="true"/>
+            </options>
+        </param>
+        <param field="Mode3" label="Ingress Port" width="75px" default=""/>
+        <param field="Mode4" label="Max Calls/s" width="75px" default="50"/>
+        <param field="Mode5" label="Interval (s)" width="75px" required="true" default="10"/>
         <param field="Mode6" label="Debug" width="75px">
             <options>
                 <option label="True" value="Debug" default="true"/>
                 <option label="False" value="Normal"/>
+                <option label="Trace" value="Trace"/>
             </options>
         </param>
     </params>
@@ -67,22 +85,20 @@
 
 ## Imports
 import Domoticz
-import urllib
-import urllib.request
 import json 
-
-# Amend the import path to enable using the Tinkerforge libraries
-# Alternate (ensure to update in case newer Python API bindings):
-# create folder tinkerforge and copy the binding content, i.e.
-# /home/pi/domoticz/plugins/tflcd20x4
+import threading
+import time
+import random
+import hashlib
+import re
+import unicodedata
+from collections import OrderedDict, deque
+import os
 from os import path
-import sys
-sys.path
-sys.path.append('/usr/local/lib/python3.7/dist-packages')
 
-import tinkerforge
-from tinkerforge.ip_connection import IPConnection
-from tinkerforge.bricklet_lcd_20x4 import BrickletLCD20x4
+# Tinkerforge Python API bindings, imported on start (see import_tinkerforge)
+IPConnection = None
+BrickletLCD20x4 = None
 
 # Units
 ## 1 for JSON text to write up-to 4 lines
@@ -98,6 +114,16 @@ UNITBUTTON0 = 5
 UNITBUTTON1 = 6
 UNITBUTTON2 = 7
 UNITBUTTON3 = 8
+## 4 long press, 4 double press and 4 hold repeat push buttons, i.e. long press of button 2 = UNITBUTTONLONG0 + 2 = 11
+UNITBUTTONLONG0 = 9
+UNITBUTTONDOUBLE0 = 13
+UNITBUTTONREPEAT0 = 17
+## 1 optional text device for the metrics (see Parameter Mode2)
+UNITMETRICS = 255
+## The units above are the units of the first display. The units of display n (0-based, see Parameter Mode1) are
+## n * UNITDISPLAYBLOCK + unit, i.e. the JSON unit of the second display is 33. Max MAXDISPLAYS displays.
+UNITDISPLAYBLOCK = 32
+MAXDISPLAYS = 7
 # Device Status Level & Text
 STATUSLEVELOK = 1
 STATUSLEVELERROR = 5
@@ -110,10 +136,140 @@ SWITCHOFF = "Off"
 # Custom Characters file JSON array format
 CUSTOMCHARFILE = "/home/pi/domoticz/plugins/tflcd20x4/customchar.json"
 
+# LCD geometry: 4 lines with 20 characters
+LCDLINES = 4
+LCDCOLUMNS = 20
+# LCD charset code displayed for characters not in the LCD charset (black square), see LCDCHARMAP
+LCDCHARUNKNOWN = 0xFF
+# LCD charset code of the custom character 0. The custom characters 0-7 are 0x08-0x0F as 0x00 ends the text.
+LCDCHARCUSTOM0 = 0x08
+# LCD charset code of the full block
+LCDCHARBLOCK = 0xFF
+
+# Glyph library (see allocate_glyphs): glyphs without fixed custom character id are allocated to the 8 custom character slots
+# on demand. In the frames, glyph n of the library is the Unicode private use character GLYPHVIRTUAL0 + n.
+GLYPHSLOTS = 8
+GLYPHVIRTUAL0 = 0xF000
+GLYPHLIBRARYSIZE = 256
+# Built-in glyphs of the bar gauges and big numerals (see render_bar, render_big), the first glyphs of the library:
+# name, 8 pixel rows. barN - N columns filled. bigupper, biglower - upper and lower half block (4 rows big numerals).
+# bigUB, bigLB, bigUMB - upper bar, lower bar and both bars, the segments of the 2 rows big numerals.
+BUILTINGLYPHS = [
+    ("bar1", (16, 16, 16, 16, 16, 16, 16, 16)), ("bar2", (24, 24, 24, 24, 24, 24, 24, 24)),
+    ("bar3", (28, 28, 28, 28, 28, 28, 28, 28)), ("bar4", (30, 30, 30, 30, 30, 30, 30, 30)),
+    ("bigupper", (31, 31, 31, 31, 0, 0, 0, 0)), ("biglower", (0, 0, 0, 0, 31, 31, 31, 31)),
+    ("bigUB", (31, 31, 31, 0, 0, 0, 0, 0)), ("bigLB", (0, 0, 0, 0, 0, 31, 31, 31)),
+    ("bigUMB", (31, 31, 31, 0, 0, 0, 31, 31)),
+]
+BUILTINGLYPH = {name: chr(GLYPHVIRTUAL0 + index) for index, (name, char) in enumerate(BUILTINGLYPHS)}
+# Big numerals: cell codes of the fonts and the characters per font as rows of cell codes.
+# 2 rows: 3 columns per digit drawn with full blocks and the bar glyphs, i.e. only 3 glyphs are used and the font fits
+# the slots left free by the characters with id of the shipped customchar.json (0-4).
+# 4 rows: 3 columns per digit drawn with half blocks, defined as 8 half rows (# filled) combined per 2 half rows to a cell,
+# i.e. only 2 glyphs are used.
+BIGCODES = {" ": " ", "#": chr(LCDCHARBLOCK), "^": BUILTINGLYPH["bigupper"], "_": BUILTINGLYPH["biglower"],
+    "U": BUILTINGLYPH["bigUB"], "B": BUILTINGLYPH["bigLB"], "M": BUILTINGLYPH["bigUMB"]}
+BIGFONT2 = {
+    "0": ("#U#", "#B#"), "1": ("U# ", "B#B"), "2": ("MM#", "#BB"), "3": ("MM#", "BB#"), "4": ("#B#", "  #"),
+    "5": ("#MM", "BB#"), "6": ("#MM", "#B#"), "7": ("UU#", "  #"), "8": ("#M#", "#B#"), "9": ("#M#", "BB#"),
+    "-": ("BBB", "   "), " ": ("   ", "   "), ".": (" ", "B"), ":": ("B", "U"),
+}
+BIGFONT4PIXELS = {
+    "0": "### #.# #.# #.# #.# #.# #.# ###", "1": ".#. ##. .#. .#. .#. .#. .#. ###",
+    "2": "### ..# ..# ### #.. #.. #.. ###", "3": "### ..# ..# ### ..# ..# ..# ###",
+    "4": "#.# #.# #.# ### ..# ..# ..# ..#", "5": "### #.. #.. ### ..# ..# ..# ###",
+    "6": "### #.. #.. ### #.# #.# #.# ###", "7": "### ..# ..# ..# ..# ..# ..# ..#",
+    "8": "### #.# #.# ### #.# #.# #.# ###", "9": "### #.# #.# ### ..# ..# ..# ###",
+    "-": "... ... ... ### ... ... ... ...", " ": "... ... ... ... ... ... ... ...",
+    ".": ". . . . . . . #", ":": ". . # . . # . .",
+}
+
+# Writer thread: max number of pending jobs and the time to wait for the thread to end when the plugin stops
+WRITERQUEUESIZE = 16
+WRITERSTOPTIMEOUT = 5
+# Writer job priorities: the pending job with the highest priority is written first, jobs with the same priority in submit order.
+# High: backlight, cursor and blinking, alert screens. Normal: display content, custom characters. Low: config check.
+PRIORITYHIGH = 0
+PRIORITYNORMAL = 1
+PRIORITYLOW = 2
+WRITERPRIORITIES = {"backlight": PRIORITYHIGH, "config": PRIORITYHIGH, "configcheck": PRIORITYLOW}
+# Writer call budget (token bucket): max bricklet calls per second set by Parameter Mode4 (0=unlimited) and max burst of calls.
+# While the budget is used up, the jobs wait in the queue, i.e. a frame submitted meanwhile replaces the pending frame.
+WRITERCALLBURST = 20
+
+# Reconnect to brickd: backoff delay (seconds) starting with the min delay, doubled per failed attempt up to the max delay.
+# The delay is jittered by -50% to not reconnect several plugins at the same time after a brickd restart.
+RECONNECTMINDELAY = 1
+RECONNECTMAXDELAY = 60
+
+# Interval (seconds) to check if the bricklet config (backlight, cursor, blinking) matches the cached config. 0=no check.
+CONFIGCHECKINTERVAL = 900
+
+# Display state journal (see save_state): frame per display, restored on start. Written if changed, max every STATEWRITEINTERVAL seconds.
+STATEFILE = "/home/pi/domoticz/plugins/tflcd20x4/state.json"
+STATEWRITEINTERVAL = 60
+# Cell marker for unknown cells in the state journal
+STATEUNKNOWNCELL = "\u0000"
+
+# Backlight policy (see update_backlight), applied if the backlight switch is On:
+# Idle time (seconds) without content changes or button presses after which the backlight is switched off. 0=never.
+BACKLIGHTIDLE = 0
+# Periods of the day the backlight is on as "HH:MM-HH:MM", i.e. ["07:00-22:30"] or over midnight ["18:00-01:00"]. Empty=always.
+BACKLIGHTSCHEDULE = []
+# Time (seconds) the backlight is on after a button press outside the schedule periods
+BACKLIGHTWAKE = 30
+
+# Screen templates file JSON array format (see load_screens). The screens are rendered by the heartbeat.
+SCREENFILE = "/home/pi/domoticz/plugins/tflcd20x4/screens.json"
+# Domoticz JSON API used to get the values of devices referenced by screen templates
+DOMOTICZHOST = "127.0.0.1"
+DOMOTICZPORT = "8080"
+DOMOTICZDEVICEURL = "/json.htm?type=devices&rid=%d"
+
+# Screen rotation: default time (seconds) a screen is displayed (see screen key "dwell")
+SCREENDWELL = 10
+# Marquee: spaces between the end and the start of a scrolling text
+MARQUEEGAP = "   "
+
+# Buttons (seconds): a button state is taken once stable for the debounce time, a press held for the long press time is a long press,
+# two presses with less than the double press time between release and press are a double press,
+# a long press held is repeated every repeat time. The button events are handled by the heartbeat (1s).
+BUTTONDEBOUNCE = 0.05
+BUTTONLONGPRESS = 1.0
+BUTTONDOUBLEPRESS = 0.4
+BUTTONREPEAT = 1.0
+# Push On switch type for the long press, double press and hold repeat buttons
+SWITCHTYPEPUSHON = 9
+
+# Number of JSON strings with the parsed line items kept (see parse_line_items)
+PARSECACHESIZE = 16
+# Alignments of a text field (line item key "align", see fit_text)
+TEXTALIGNS = ("left", "right", "center")
+
+# Ingress listener (see Parameter Mode3): address listened on, max size (bytes) of a message
+# A message is a JSON array of line items (TCP: terminated by newline) or a binary frame starting with INGRESSBINARY (see split_ingress).
+INGRESSADDRESS = "127.0.0.1"
+INGRESSMAXSIZE = 4096
+INGRESSBINARY = 0x00
+
+# Device updates (see update_device): min time (seconds) between updates of a device, later updates within are coalesced
+DEVICEUPDATEWINDOW = 1.0
+
+# Trace file (JSON lines, see class LCDTrace) recorded if Parameter Mode6 is Trace. Replayed by bench/replay.py.
+TRACEFILE = "/home/pi/domoticz/plugins/tflcd20x4/trace.jsonl"
+
+# Interval (seconds) the metrics are aggregated and published to the debug log and the metrics device
+METRICSINTERVAL = 300
+
+# Folders searched for the Tinkerforge Python API bindings if not found in the Python path (see import_tinkerforge)
+TINKERFORGEPATHS = ["/usr/local/lib/python3*/dist-packages", "/usr/lib/python3/dist-packages", "/usr/local/lib/python3*/site-packages"]
+
 # Messages (not all)
 MSGERRNOIPCONN = "[ERROR] IP Connection failed. Check the settings."
 MSGERRNOUID = "[ERROR] Bricklet UID not set. Get the UID using the Brick Viewer."
 MSGERRSETCONFIG = "[ERROR] Set bricklet configuration failed. Check bricklet and settings."
+MSGERRNOTSTARTED = "[ERROR] Bricklet not started. Check the settings."
+MSGERRNOBINDINGS = "[ERROR] Tinkerforge Python API bindings not found. Install using sudo pip3 install tinkerforge."
 
 class BasePlugin:
 
@@ -122,96 +278,204 @@ class BasePlugin:
         # HTTP Connection
         self.httpConn = None
         self.httpConnected = 0
+        # Ingress listeners (UDP, TCP) and the data received per TCP client not yet handled: client -> bytes
+        self.ingressUDP = None
+        self.ingressTCP = None
+        self.ingressBuffers = {}
 
-        # Tinkerforge ipconnection and iodevice
-        # Flag to check if connected to the master brick
-        self.ipConn = None
-        self.ipConnected = 0
-        self.lcdDev = None
-        self.lcdUID = None
+        # Displays (see class LCDDisplay), each with its bricklet and writer thread owning all bricklet I/O (see class LCDWriter)
+        self.displays = []
+        # Tinkerforge ipconnections shared by the displays per brickd host:port -> LCDConnection
+        # The ipconnection (see class LCDConnection) reconnects if brickd or the master brick is lost
+        self.lcdConnections = {}
+        # Metrics of the write pipeline (see class LCDMetrics), created on start
+        self.metrics = None
+        # Trace of the plugin input (see class LCDTrace), recorded if Parameter Mode6 is Trace
+        self.trace = None
+        self.metricsTime = 0
+        # Custom characters: file modification time and hash of the file last read (see update_custom_characters)
+        self.customCharTime = None
+        self.customCharHash = None
+        # Glyph tokens {name} of the custom characters: name -> LCD character, compiled token pattern (see encode_text)
+        self.glyphs = {}
+        self.glyphPattern = None
+        # Glyph library (name, character), built-in glyphs first, and the custom character slots of the characters with id (see allocate_glyphs)
+        self.glyphLibrary = list(BUILTINGLYPHS)
+        self.pinnedSlots = set()
+        # Line items parsed: hash of the display index and JSON string -> (display, line items, calls), least recently used first (see parse_line_items)
+        self.parseCache = OrderedDict()
+        # Screen templates (see load_screens): file modification time, compiled screens
+        self.screenTime = None
+        self.screens = []
+        # Backlight schedule periods as tuple (start minute, end minute) of the day (see parse_backlight_schedule).
+        # The lock serializes the backlight policy of the plugin thread and the button callback thread.
+        self.backlightSchedule = []
+        self.backlightLock = threading.Lock()
+        # Display state journal: time and content of the last write (see save_state)
+        self.stateTime = 0
+        self.stateContent = None
+        # Device updates held back by the coalescing window: unit -> (nValue, sValue), time of the last update per unit,
+        # number of updates not made (unchanged or coalesced, see update_device)
+        self.deviceUpdates = {}
+        self.deviceUpdateTimes = {}
+        self.deviceUpdatesSaved = 0
+        # Button events (display, button, state, time) appended by the Tinkerforge callback thread, handled by the heartbeat
+        self.buttonEvents = deque()
+        self.buttonEventsDropped = 0
+        self.buttonEventsCoalesced = 0
+        # Values of the devices referenced by the screens: idx -> JSON API device result. Requested via self.httpConn.
+        self.deviceValues = {}
+        self.screenDevices = []
+        self.deviceRequests = []
         
-        # NOT USED=Placeholder
-        # The Domoticz heartbeat is set to every 10 seconds. Do not use a higher value than 30 as Domoticz message "Error: hardware (N) thread seems to have ended unexpectedly"
-        # The plugin heartbeat is set in Parameter.Mode5 (seconds). This is determined by using a hearbeatcounter which is triggered by:
+        # The Domoticz heartbeat is set to every second, used to rotate the screens and scroll the marquee texts.
+        # Do not use a higher value than 30 as Domoticz message "Error: hardware (N) thread seems to have ended unexpectedly"
+        # The plugin interval is set in Parameter.Mode5 (seconds). This is determined by using a hearbeatcounter which is triggered by:
         # (self.HeartbeatCounter * self.HeartbeatInterval) % int(Parameter.Mode5) = 0
-        # Example: trigger action every 60s [every 6 heartbeats] = (6 * 10) mod 60 = 0 or every 5 minutes (300s) [every 30 heartbeats] = (30 * 10) mod 300 = 0
-        # self.HeartbeatInterval = 10
-        # self.HeartbeatCounter = 0
+        # Example: trigger action every 60s [every 60 heartbeats] = (60 * 1) mod 60 = 0 or every 5 minutes (300s) [every 300 heartbeats] = (300 * 1) mod 300 = 0
+        self.HeartbeatInterval = 1
+        self.HeartbeatCounter = 0
+        self.Interval = 10
 
     def onStart(self):
+        # Startup timing: (phase, end time)
+        startTime = time.perf_counter()
+        timings = []
         Domoticz.Debug("onStart called")
         Domoticz.Debug("Debug Mode:" + Parameters["Mode6"])
-        if Parameters["Mode6"] == "Debug":
+        if Parameters["Mode6"] in ("Debug", "Trace"):
             self.debug = True
             Domoticz.Debugging(1)
             write_config_to_log()
+        if Parameters["Mode6"] == "Trace":
+            try:
+                self.trace = LCDTrace(TRACEFILE, Parameters["Mode1"])
+                Domoticz.Log("Trace: Recording to file=%s." % (TRACEFILE) )
+            except OSError as e:
+                Domoticz.Error("Trace: Can not write file=%s (%s)." % (TRACEFILE, e) )
 
-        if (len(Devices) == 0):
-            # Create new devices for the Hardware
-            Domoticz.Debug("Creating devices")
-            # General;Text
-            Domoticz.Device(Name="JSON", Unit=UNITJSON, TypeName="Text", Used=1).Create()
-            Domoticz.Debug("Device created: "+Devices[UNITJSON].Name)
-            # Switches for the configuration
-            Domoticz.Device(Name="Backlight", Unit=UNITBACKLIGHT, TypeName="Switch", Used=1).Create()
-            Devices[UNITBACKLIGHT].Update(nValue=1,sValue="")
-            Domoticz.Debug("Device created: "+Devices[UNITBACKLIGHT].Name)
-            Domoticz.Device(Name="Cursor", Unit=UNITCURSOR, TypeName="Switch", Used=1).Create()
-            Domoticz.Debug("Device created: "+Devices[UNITCURSOR].Name)
-            Domoticz.Device(Name="Blinking", Unit=UNITBLINKING, TypeName="Switch", Used=1).Create()
-            Domoticz.Debug("Device created: "+Devices[UNITBLINKING].Name)
-            # Swiches for the push-buttons
-            Domoticz.Device(Name="Button 0", Unit=UNITBUTTON0, TypeName="Switch", Used=1).Create()
-            Domoticz.Debug("Device created: "+Devices[UNITBUTTON0].Name)
-            Domoticz.Device(Name="Button 1", Unit=UNITBUTTON1, TypeName="Switch", Used=1).Create()
-            Domoticz.Debug("Device created: "+Devices[UNITBUTTON1].Name)
-            Domoticz.Device(Name="Button 2", Unit=UNITBUTTON2, TypeName="Switch", Used=1).Create()
-            Domoticz.Debug("Device created: "+Devices[UNITBUTTON2].Name)
-            Domoticz.Device(Name="Button 3", Unit=UNITBUTTON3, TypeName="Switch", Used=1).Create()
-            Domoticz.Debug("Device created: "+Devices[UNITBUTTON3].Name)
-            Domoticz.Debug("Creating device: OK")
-
-        # Get the UID of the bricklet
-        self.lcdUID = Parameters["Mode1"]
-        if len(self.lcdUID) == 0:
-            write_to_log(STATUSLEVELERROR, MSGERRNOUID)
+        # Heartbeat and plugin interval
+        Domoticz.Heartbeat(self.HeartbeatInterval)
+        try:
+            self.Interval = max(int(Parameters["Mode5"]), self.HeartbeatInterval)
+        except (KeyError, ValueError):
+            self.Interval = 10
+
+        self.metrics = LCDMetrics()
+        self.metricsTime = time.time()
+
+        if not import_tinkerforge():
+            write_to_log(STATUSLEVELERROR, MSGERRNOBINDINGS)
             return
+        timings.append(("Import", time.perf_counter()))
 
-        # Flag to check if connected to the master brick
-        self.ipConnected = 0
-        # Create IP connection
-        self.ipConn = IPConnection()
-        # Create device object
-        self.lcdDev = BrickletLCD20x4(self.lcdUID, self.ipConn)
+        self.backlightSchedule = parse_backlight_schedule(BACKLIGHTSCHEDULE)
 
-        # Connect to brickd using Host and Port
+        # Bricklet call budget per display
         try:
-            self.ipConn.connect(Parameters["Address"], int(Parameters["Port"]))
-            self.ipConnected = 1
-            Domoticz.Debug("IP Connection - OK")
-        except:
+            rate = max(float(Parameters.get("Mode4") or 0), 0)
+        except ValueError:
+            rate = 0
+            Domoticz.Error("Wrong Max Calls/s=%s. Ensure a number, 0=unlimited." % (Parameters.get("Mode4")) )
+
+        # Get the displays: UIDs of the bricklets with optional brickd host and port
+        try:
+            port = int(Parameters["Port"])
+        except ValueError:
+            Domoticz.Error("Wrong Port=%s. Ensure a number." % (Parameters["Port"]) )
             write_to_log(STATUSLEVELERROR, MSGERRNOIPCONN)
             return
-       
-        # Set the bricklet configuration: backlight, cursor, blink are set according their switch device state
-        set_configuration(self)
-        
-        # Register button pressed callback to function cb_button_pressed
-        self.lcdDev.register_callback(self.lcdDev.CALLBACK_BUTTON_PRESSED, onButtonPressedCallback)
+        displays = parse_displays(Parameters["Mode1"], Parameters["Address"], port)
+        if len(displays) == 0:
+            write_to_log(STATUSLEVELERROR, MSGERRNOUID)
+            return
+
+        for index, (uid, host, port) in enumerate(displays):
+            display = LCDDisplay(index, uid, host, port)
+            create_devices(display)
+            timings.append(("Devices", time.perf_counter()))
+            # Create IP connection, shared by the displays connected to the same brickd.
+            # The connection to brickd using Host and Port is made by the writer threads.
+            key = "%s:%d" % (host, port)
+            if key not in self.lcdConnections:
+                self.lcdConnections[key] = LCDConnection(host, port, self.metrics)
+            connection = self.lcdConnections[key]
+            # Create device object
+            display.lcdDev = BrickletLCD20x4(uid, connection.ipConn)
+            # Start the writer thread. The plugin callbacks only submit jobs to the writer, i.e. a slow display does not block the others.
+            display.lcdWriter = LCDWriter(uid, display.lcdDev, connection, self.metrics, rate)
+            display.lcdWriter.start()
+            # Register button pressed and released callbacks
+            display.lcdDev.register_callback(display.lcdDev.CALLBACK_BUTTON_PRESSED, lambda button, index=index: onButtonPressedCallback(index, button))
+            display.lcdDev.register_callback(display.lcdDev.CALLBACK_BUTTON_RELEASED, lambda button, index=index: onButtonReleasedCallback(index, button))
+            self.displays.append(display)
+            Domoticz.Debug("Display %d: UID=%s,Host=%s,Port=%d,Units=%d-%d" % (index, uid, host, port, display.unit(UNITJSON), display.unit(UNITBUTTONREPEAT0 + 3)) )
 
-        # Register button released callback to function cb_button_released
-        self.lcdDev.register_callback(self.lcdDev.CALLBACK_BUTTON_RELEASED, onButtonReleasedCallback)
+            timings.append(("Displays", time.perf_counter()))
+
+        # Optional text device for the metrics
+        if Parameters.get("Mode2") == "True" and UNITMETRICS not in Devices:
+            Domoticz.Device(Name="Metrics", Unit=UNITMETRICS, TypeName="Text", Used=1).Create()
+            Domoticz.Debug("Device created: "+Devices[UNITMETRICS].Name)
+        timings.append(("Devices", time.perf_counter()))
+
+        # Set the bricklet configuration: backlight, cursor, blink are set according their switch device state.
+        # The jobs are written by the writer threads as soon as connected, i.e. after onStart returned.
+        for display in self.displays:
+            set_configuration(self, display)
+        timings.append(("Config", time.perf_counter()))
+        # Set Custom Characters (see update_custom_characters)
+        update_custom_characters(self)
+        timings.append(("Customchar", time.perf_counter()))
+
+        # Restore the display content of the last run, written as first frame by the writer threads
+        restore_state(self)
+        timings.append(("State", time.perf_counter()))
+
+        # Load the screen templates, if defined
+        load_screens(self)
+        timings.append(("Screens", time.perf_counter()))
+
+        # Listen for line items sent directly to the plugin, if the ingress port is set
+        start_ingress(self)
+        timings.append(("Ingress", time.perf_counter()))
+        log_startup_timings(startTime, timings)
 
     def onStop(self):
         Domoticz.Debug("Plugin is stopping.")
-        if self.ipConnected == 1:
-            self.ipConn.disconnect()
+        save_state(self, True)
+        flush_device_updates(self, True)
+        if self.trace is not None:
+            self.trace.close(self.displays)
+            self.trace = None
+        # The writer threads must have ended before Domoticz unloads the plugin
+        for display in self.displays:
+            display.lcdWriter.stop()
+        for connection in self.lcdConnections.values():
+            connection.close()
 
     def onConnect(self, Connection, Status, Description):
         Domoticz.Debug("onConnect called")
+        if Connection.Name == "IngressTCP":
+            Domoticz.Debug("Ingress: Client=%s:%s connected." % (Connection.Address, Connection.Port) )
+            self.ingressBuffers[ingress_client(Connection)] = b""
+        if Connection.Name == "DomoticzAPI":
+            if Status == 0:
+                self.httpConnected = 1
+                request_next_device_value(self)
+            else:
+                self.httpConnected = 0
+                self.deviceRequests = []
+                Domoticz.Error("Screens: Connection to the Domoticz API failed (%s). Check DOMOTICZHOST and DOMOTICZPORT." % (Description) )
 
     def onMessage(self, Connection, Data):
+        if Connection.Name in ("IngressUDP", "IngressTCP"):
+            handle_ingress(self, Connection, Data)
+            return
         Domoticz.Debug("onMessage called")
+        if Connection.Name == "DomoticzAPI":
+            handle_device_value(self, Data)
+            request_next_device_value(self)
 
     # Handle commands from the various switch devices
     # Example set backlight: if the switch backlight is switched to on, the lcd backlight is turned on by the api functionlcd.backlight_on()
@@ -219,17 +483,24 @@ class BasePlugin:
         Domoticz.Debug("onCommand called for Unit " + str(Unit) + ": Parameter '" + str(Command) + "', Level: " + str(Level) + "', Hue: " + str(Hue))
         # Check unit, action, update the device
         # For the backlight,cursor,blinking the command is "On" or "Off"
-        if Unit == UNITBACKLIGHT:
-            set_backlight(self,Command)
-        if Unit == UNITCURSOR:
-            set_cursor(self,Command)
-        if Unit == UNITBLINKING:
-            set_blinking(self,Command)
+        if self.trace is not None:
+            self.trace.record("command", Unit, Command, Level)
+        display, unit = get_display_unit(self, Unit)
+        if display is None:
+            return
+        if unit == UNITBACKLIGHT:
+            set_backlight(self,display,Command)
+        if unit == UNITCURSOR:
+            set_cursor(self,display,Command)
+        if unit == UNITBLINKING:
+            set_blinking(self,display,Command)
 
     # Handle new text from the text units (devices). The text is in property Devices[Unit].sValue
     # The new text is taken from the device and written to the LCD display
     def onDeviceModified(self, Unit):
         Domoticz.Debug("onDeviceModified called Unit:" + str(Unit) + " (" + Devices[Unit].Name + "),nValue="+str(Devices[Unit].nValue) + ",sValue="+Devices[Unit].sValue)
+        if self.trace is not None:
+            self.trace.record("device", Unit, Devices[Unit].sValue)
         write_lines(self, Unit)
         
     def onNotification(self, Name, Subject, Text, Status, Priority, Sound, ImageFile):
@@ -237,24 +508,41 @@ class BasePlugin:
 
     def onDisconnect(self, Connection):
         Domoticz.Debug("onDisconnect called")
-        if self.ipConnected == 1:
-            self.ipConn.disconnect()
+        if Connection.Name == "IngressTCP":
+            self.ingressBuffers.pop(ingress_client(Connection), None)
+        if Connection.Name == "DomoticzAPI":
+            self.httpConnected = 0
+            self.deviceRequests = []
 
     def onHeartbeat(self):
-        Domoticz.Debug("onHeartbeat called")
-        # NOT USED = PLACEHOLDER
-        """
         self.HeartbeatCounter = self.HeartbeatCounter + 1
-        Domoticz.Debug("onHeartbeat called. Counter=" + str(self.HeartbeatCounter * self.HeartbeatInterval) + " (Heartbeat=" + Parameters["Mode5"] + ")")
-        # check the heartbeatcounter against the heartbeatinterval
-        if (self.HeartbeatCounter * self.HeartbeatInterval) % int(Parameters["Mode5"]) == 0:
-            try:
-                #Domoticz.Log(
-                return
-            except:
-                #Domoticz.Error("[ERROR] ...")
-                return
-        """
+        if len(self.displays) == 0:
+            return
+        # Every heartbeat: handle the button events, rotate the screens and scroll the marquee texts
+        handle_button_events(self)
+        render_screen(self)
+        for display in self.displays:
+            update_backlight(self, display)
+        flush_device_updates(self)
+        save_state(self)
+        # check the heartbeatcounter against the plugin interval
+        if (self.HeartbeatCounter * self.HeartbeatInterval) % self.Interval == 0:
+            Domoticz.Debug("onHeartbeat called. Counter=" + str(self.HeartbeatCounter * self.HeartbeatInterval) + " (Interval=" + str(self.Interval) + ")")
+            update_custom_characters(self)
+            for display in self.displays:
+                display.lcdWriter.schedule_config_check()
+            load_screens(self)
+            request_device_values(self)
+            for display in self.displays:
+                Domoticz.Debug(display.lcdWriter.get_status())
+            for connection in self.lcdConnections.values():
+                Domoticz.Debug(connection.get_status())
+            Domoticz.Debug("Buttons: EventsDropped=%d,EventsCoalesced=%d" % (self.buttonEventsDropped, self.buttonEventsCoalesced) )
+            Domoticz.Debug("Devices: UpdatesSaved=%d,UpdatesPending=%d" % (self.deviceUpdatesSaved, len(self.deviceUpdates)) )
+            if self.trace is not None:
+                self.trace.flush()
+        if time.time() - self.metricsTime >= METRICSINTERVAL:
+            publish_metrics(self)
 
 global _plugin
 _plugin = BasePlugin()
@@ -297,108 +585,275 @@ def onHeartbeat():
 
 # Tinkerforge Bricklet
 
+"""
+Import the Tinkerforge Python API bindings on plugin start.
+The bindings are imported from the Python path, i.e. installed by pip3 for the Python version used by Domoticz
+or copied to the subfolder tinkerforge of the plugin folder. If not found, the bindings are searched in the
+folders TINKERFORGEPATHS (i.e. installed for another Python 3 version) and the folder found is added to the Python path.
+Return:
+True if imported
+"""
+def import_tinkerforge():
+    global IPConnection, BrickletLCD20x4
+    try:
+        from tinkerforge.ip_connection import IPConnection
+        from tinkerforge.bricklet_lcd_20x4 import BrickletLCD20x4
+        return True
+    except ImportError:
+        pass
+    import glob
+    import sys
+    for pattern in TINKERFORGEPATHS:
+        for folder in sorted(glob.glob(pattern), reverse=True):
+            if path.isfile(path.join(folder, "tinkerforge", "ip_connection.py")):
+                Domoticz.Log("Tinkerforge Python API bindings found in %s." % (folder) )
+                sys.path.append(folder)
+                try:
+                    from tinkerforge.ip_connection import IPConnection
+                    from tinkerforge.bricklet_lcd_20x4 import BrickletLCD20x4
+                    return True
+                except ImportError as e:
+                    Domoticz.Error("Tinkerforge Python API bindings in %s not imported (%s)." % (folder, e) )
+                    sys.path.remove(folder)
+    return False
+
+"""
+Log the time spent per startup phase. The phases with the same name are summed up.
+The connect and the bricklet writes are done by the writer threads after onStart returned (see LCDWriter).
+Parameter:
+startTime - time.perf_counter() at the start
+timings - list of tuple (phase, time.perf_counter() at the end of the phase)
+"""
+def log_startup_timings(startTime, timings):
+    phases = OrderedDict()
+    last = startTime
+    for phase, end in timings:
+        phases[phase] = phases.get(phase, 0) + end - last
+        last = end
+    Domoticz.Log("Startup: %.1fms (%s)" % ((last - startTime) * 1000, ",".join("%s=%.1fms" % (phase, duration * 1000) for phase, duration in phases.items())) )
+
 """
 Set the bricklet configuration
 Parameter:
+display - LCDDisplay
 """
-def set_configuration(self):
-    Domoticz.Debug("set_configuration. IP-Connected: %d" % (self.ipConnected) )
-    if self.ipConnected == 0:
-        write_to_log(STATUSLEVELERROR, "Set configuration. Not connected to the Master Brick. Check settings, correct and restart Domoticz." )
-        return
-        
+def set_configuration(self, display):
+    Domoticz.Debug("set_configuration: Display %d" % (display.index) )
     try:
-        state = SWITCHON if Devices[UNITBACKLIGHT].nValue == 1 else SWITCHOFF
-        set_backlight(self,state)
-        state = SWITCHON if Devices[UNITCURSOR].nValue == 1 else SWITCHOFF
-        set_cursor(self,state)
-        state = SWITCHON if Devices[UNITBLINKING].nValue == 1 else SWITCHOFF
-        set_blinking(self,state)
-        
-        # Set Custom Characters with index 0-7 as max 8 custom characters can be defined.
-        # dzVents Lua scripts:
-        # The \ character needs to be escaped, i.e. line = string.format(line, l, p, "\\u0008", domoticz.helpers.isnowhhmm(domoticz) )
-        # Ensure to write in unicode \u00NN and NOT \xNN - Example: lcdDev.write_line(0, 0, "Battery: " + "\u0008")
-        # JSON has no hex escape \xNN but supports unicode escape \uNNNN
-        # 
-        # Example custom character definition and write to the lcd:
-        #     battery = [14,27,17,17,17,17,17,31] 
-        #     clock = [31,17,10,4,14,31,31,0]
-        #     lcdDev.set_custom_character(0, clock)
-        # 
-        # JSON File
-        # Read the custom characters from JSON array file as defined by constant CUSTOMCHARFILE
-        # JSON format examplewith 2 characters: 
-        # [
-        #     {"id":0,"name":"battery","char":"14,27,17,17,17,17,17,31"},
-        #     {"id":1,"name":"clock","char":"31,17,10,4,14,31,31,0"}
-        # ]
-        # Use exception handling in case file not found
-        # The id must be in range 0-7 as max 8 custom characters can be defined
-        try:
-            with open(CUSTOMCHARFILE) as f:
-                json_char_array = json.load(f)
-                Domoticz.Debug("Customchar: characters: %d" % (len(json_char_array)) )
-                if len(json_char_array) > 0:
-                    for item in json_char_array:
-                        id = int(item["id"])
-                        name = item["name"]
-                        char = item["char"].strip().split(",")
-                        # Check if the character id is in range 0-7
-                        if id >= 0 and id <= 7:
-                            self.lcdDev.set_custom_character(id, char)
-                            Domoticz.Debug("Customchar: Index=%d,Name=%s,Char=%s" % (id,name,item["char"]) )
-                        else:
-                            Domoticz.Error("Customchar: Index=%d not in range 0-7." % (id) )
-                else:
-                    Domoticz.Error("Customchar: No or wrong characters defined.")
-        except:
-            Domoticz.Error("Customchar: Can not open file=%s." % (CUSTOMCHARFILE) )
+        state = SWITCHON if Devices[display.unit(UNITBACKLIGHT)].nValue == 1 else SWITCHOFF
+        set_backlight(self,display,state)
+        state = SWITCHON if Devices[display.unit(UNITCURSOR)].nValue == 1 else SWITCHOFF
+        set_cursor(self,display,state)
+        state = SWITCHON if Devices[display.unit(UNITBLINKING)].nValue == 1 else SWITCHOFF
+        set_blinking(self,display,state)
         Domoticz.Debug("set_configuration OK")
     except:
         write_to_log(STATUSLEVELERROR, "Set configuration failed. Check settings, correct and restart Domoticz." )
     return
 
+"""
+Set Custom Characters with index 0-7 as max 8 custom characters can be defined.
+The file is read at plugin start and read again by the heartbeat if the file modification time changed,
+i.e. the custom characters can be changed without restarting the plugin. If the file content (hash) is unchanged,
+the file is not parsed. Only the characters changed are submitted to the writer thread, which also skips
+characters already uploaded to the bricklet.
+"""
+def update_custom_characters(self):
+    # dzVents Lua scripts:
+    # The \ character needs to be escaped, i.e. line = string.format(line, l, p, "\\u0008", domoticz.helpers.isnowhhmm(domoticz) )
+    # Ensure to write in unicode \u00NN and NOT \xNN - Example: lcdDev.write_line(0, 0, "Battery: " + "\u0008")
+    # JSON has no hex escape \xNN but supports unicode escape \uNNNN
+    # 
+    # Example custom character definition and write to the lcd:
+    #     battery = [14,27,17,17,17,17,17,31] 
+    #     clock = [31,17,10,4,14,31,31,0]
+    #     lcdDev.set_custom_character(0, clock)
+    # 
+    # JSON File
+    # Read the custom characters from JSON array file as defined by constant CUSTOMCHARFILE
+    # JSON format examplewith 2 characters: 
+    # [
+    #     {"id":0,"name":"battery","char":"14,27,17,17,17,17,17,31"},
+    #     {"id":1,"name":"clock","char":"31,17,10,4,14,31,31,0"}
+    # ]
+    # The id must be in range 0-7 as max 8 custom characters can be defined
+    # Use exception handling in case file not found
+    try:
+        mtime = path.getmtime(CUSTOMCHARFILE)
+    except OSError:
+        # Log once and not every heartbeat
+        if self.customCharTime != -1:
+            Domoticz.Error("Customchar: Can not open file=%s." % (CUSTOMCHARFILE) )
+        self.customCharTime = -1
+        return
+    if mtime == self.customCharTime:
+        return
+    self.customCharTime = mtime
+    try:
+        with open(CUSTOMCHARFILE, "rb") as f:
+            content = f.read()
+    except OSError:
+        Domoticz.Error("Customchar: Can not open file=%s." % (CUSTOMCHARFILE) )
+        return
+    digest = hashlib.sha1(content).hexdigest()
+    if digest == self.customCharHash:
+        Domoticz.Debug("Customchar: File unchanged.")
+        return
+    parsed = parse_custom_characters(content)
+    if parsed is None:
+        return
+    chars, names, library = parsed
+    self.customCharHash = digest
+    set_glyphs(self, names, library)
+    self.pinnedSlots = set(chars)
+    changed = 0
+    for display in self.displays:
+        # The glyphs of the library are allocated again with the next frame
+        display.glyphSlots.clear()
+        for id, char in chars.items():
+            if display.customChars.get(id) != char:
+                display.customChars[id] = char
+                display.lcdWriter.submit("char%d" % (id), display.lcdWriter.apply_custom_character, id, char)
+                changed += 1
+    Domoticz.Debug("Customchar: Characters=%d,Glyphs=%d,Changed=%d" % (len(chars), len(library), changed) )
+
+"""
+Parse the custom characters JSON array. Characters without id (or id greater 7) are glyphs of the library,
+allocated to a custom character slot when displayed (see allocate_glyphs).
+Parameter:
+content - JSON array string (bytes) as defined in the custom characters file
+Return:
+tuple (dict id -> character as tuple with 8 integers (pixel rows), dict name -> id,
+list of glyphs without id as tuple (name, character)) or None if not parsed
+"""
+def parse_custom_characters(content):
+    try:
+        json_char_array = json.loads(content.decode("utf-8"))
+    except ValueError:
+        Domoticz.Error("Customchar: No or wrong characters defined.")
+        return None
+    if len(json_char_array) == 0:
+        Domoticz.Error("Customchar: No or wrong characters defined.")
+        return None
+    chars = {}
+    names = {}
+    library = []
+    for item in json_char_array:
+        try:
+            id = int(item["id"]) if "id" in item else None
+            name = item["name"]
+            char = tuple(int(row) for row in item["char"].strip().split(","))
+        except (KeyError, ValueError, AttributeError):
+            Domoticz.Error("Customchar: Wrong character definition %s." % (item) )
+            continue
+        # Check if the character id is not negative and the character has 8 rows with 5 pixels
+        if id is not None and id < 0:
+            Domoticz.Error("Customchar: Index=%d not in range 0-7." % (id) )
+        elif len(char) != 8 or min(char) < 0 or max(char) > 31:
+            Domoticz.Error("Customchar: Name=%s requires 8 values 0-31." % (name) )
+        elif id is None or id > 7:
+            library.append((name, char))
+            Domoticz.Debug("Customchar: Glyph=%s,Char=%s" % (name,item["char"]) )
+        else:
+            chars[id] = char
+            names[name] = id
+            Domoticz.Debug("Customchar: Index=%d,Name=%s,Char=%s" % (id,name,item["char"]) )
+    return chars, names, library
+
 """
 Set the lcd backlight On or Off and update the Domoticz switch device to On or Off
 Parameter
+display - LCDDisplay
 state - String On or Off - note the string is case sensitive
 """
-def set_backlight(self,state):
-    Domoticz.Debug("set_backlight: Change state=%s" % (state) )
-    if self.ipConnected == 0:
-        write_to_log(STATUSLEVELERROR, "[ERROR] Set backlight failed. Not connected to the Master Brick. Check settings." )
-        return
+def set_backlight(self,display,state):
+    Domoticz.Debug("set_backlight: Display %d change state=%s" % (display.index,state) )
     try:
-        if state == SWITCHON:
-            self.lcdDev.backlight_on()
-            Devices[UNITBACKLIGHT].Update(nValue=1,sValue="")
-        else:
-            self.lcdDev.backlight_off()
-            Devices[UNITBACKLIGHT].Update(nValue=0,sValue="")
+        # The switch enables the backlight, switched on and off by the backlight policy
+        display.backlight = state == SWITCHON
+        display.activityTime = time.time()
+        update_backlight(self, display)
+        update_device(self, display.unit(UNITBACKLIGHT), 1 if display.backlight else 0, "")
         Domoticz.Debug("set_backlight: OK")
     except:
         write_to_log(STATUSLEVELERROR, "[ERROR] Set backlight failed. Check settings." )
     return
 
+"""
+Apply the backlight policy to the bricklet backlight. Called every heartbeat, by set_backlight and wake_backlight.
+If the backlight switch is On, the backlight is on during the schedule periods (BACKLIGHTSCHEDULE) until no content
+changed and no button was pressed for BACKLIGHTIDLE. A button press switches it on for BACKLIGHTWAKE outside the periods.
+The backlight state is tracked, i.e. the writer is only called if the state changes and the switch device is not updated.
+Parameter
+display - LCDDisplay
+"""
+def update_backlight(self, display):
+    with self.backlightLock:
+        now = time.time()
+        on = display.backlight and ((is_backlight_scheduled(self, time.localtime(now)) and (BACKLIGHTIDLE == 0 or now - display.activityTime < BACKLIGHTIDLE))
+            or now - display.wakeTime < BACKLIGHTWAKE)
+        if on == display.backlightOn:
+            return
+        display.backlightOn = on
+        display.lcdWriter.submit("backlight", display.lcdWriter.apply_backlight, on)
+    Domoticz.Debug("Backlight: Display %d %s" % (display.index, SWITCHON if on else SWITCHOFF) )
+
+"""
+Wake the backlight of a display on a content change or a button press (see update_backlight).
+A content change resets the idle time, a button press also switches the backlight on outside the schedule periods.
+Parameter
+display - LCDDisplay
+button - True for a button press (called by the Tinkerforge callback thread)
+"""
+def wake_backlight(self, display, button=False):
+    display.activityTime = time.time()
+    if button:
+        display.wakeTime = display.activityTime
+    if display.backlightOn is False:
+        update_backlight(self, display)
+
+"""
+Check if the time is within a backlight schedule period. Without periods the backlight is always scheduled.
+Parameter
+now - time.struct_time
+"""
+def is_backlight_scheduled(self, now):
+    if len(self.backlightSchedule) == 0:
+        return True
+    minute = now.tm_hour * 60 + now.tm_min
+    for start, end in self.backlightSchedule:
+        if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+            return True
+    return False
+
+"""
+Parse the backlight schedule periods "HH:MM-HH:MM" (see BACKLIGHTSCHEDULE).
+Return:
+list of tuple (start minute, end minute) of the day
+"""
+def parse_backlight_schedule(entries):
+    periods = []
+    for entry in entries:
+        try:
+            start, end = [time.strptime(t.strip(), "%H:%M") for t in entry.split("-")]
+            periods.append((start.tm_hour * 60 + start.tm_min, end.tm_hour * 60 + end.tm_min))
+        except ValueError:
+            Domoticz.Error("Backlight: Wrong schedule period %s. Ensure HH:MM-HH:MM." % (entry) )
+    return periods
+
 """
 Set the lcd cursor to On or Off and update the Domoticz switch device to On or Off
 Parameter
+display - LCDDisplay
 state - String On or Off - note the string is case sensitive
 """
-def set_cursor(self,state):
-    Domoticz.Debug("set_cursor: Change state=%s" % (state) )
-    if self.ipConnected == 0:
-        write_to_log(STATUSLEVELERROR, "Set cursor failed. Not connected to the Master Brick. Check settings." )
-        return
+def set_cursor(self,display,state):
+    Domoticz.Debug("set_cursor: Display %d change state=%s" % (display.index,state) )
     try:
-        obj = self.lcdDev.get_config()
-        if state == SWITCHON:
-            self.lcdDev.set_config(True, obj.blinking)
-            Devices[UNITCURSOR].Update(nValue=1,sValue="")
-        else:
-            self.lcdDev.set_config(False, obj.blinking)
-            Devices[UNITCURSOR].Update(nValue=0,sValue="")
+        # Cursor and blinking are set by a single set_config using the cached blinking state
+        display.cursor = state == SWITCHON
+        display.lcdWriter.submit("config", display.lcdWriter.apply_config, display.cursor, display.blinking)
+        update_device(self, display.unit(UNITCURSOR), 1 if state == SWITCHON else 0, "")
         Domoticz.Debug("set_cursor: OK")
     except:
         write_to_log(STATUSLEVELERROR, "Set cursor failed. Check settings." )
@@ -407,26 +862,192 @@ def set_cursor(self,state):
 """
 Set the lcd cursor blinking to On or Off and update the Domoticz switch device to On or Off
 Parameter
+display - LCDDisplay
 state - String On or Off - note the string is case sensitive
 """
-def set_blinking(self,state):
-    Domoticz.Debug("set_blinking: Change state=%s" % (state) )
-    if self.ipConnected == 0:
-        write_to_log(STATUSLEVELERROR, "Set blinking failed. Not connected to the Master Brick. Check settings." )
-        return
+def set_blinking(self,display,state):
+    Domoticz.Debug("set_blinking: Display %d change state=%s" % (display.index,state) )
     try:
-        obj = self.lcdDev.get_config()
-        if state == SWITCHON:
-            self.lcdDev.set_config(obj.cursor, True)
-            Devices[UNITBLINKING].Update(nValue=1,sValue="")
-        else:
-            self.lcdDev.set_config(obj.cursor, False)
-            Devices[UNITBLINKING].Update(nValue=0,sValue="")
+        # Cursor and blinking are set by a single set_config using the cached cursor state
+        display.blinking = state == SWITCHON
+        display.lcdWriter.submit("config", display.lcdWriter.apply_config, display.cursor, display.blinking)
+        update_device(self, display.unit(UNITBLINKING), 1 if state == SWITCHON else 0, "")
         Domoticz.Debug("set_blinking: OK")
     except:
         write_to_log(STATUSLEVELERROR, "Set blinking failed. Check settings." )
     return
 
+"""
+Create a frame holding the content of the display.
+A frame is a list of 4 lines, each line a list of 20 cells with a single character.
+Parameter:
+fill - cell content: None=unknown (default), " "=cleared display
+"""
+def new_frame(fill=None):
+    return [[fill] * LCDCOLUMNS for line in range(LCDLINES)]
+
+"""
+Compose the frame resulting from writing line items to a frame.
+The frame is not changed, a new frame is returned.
+Parameter:
+frame - frame to start from
+items - list of validated line items as tuple (line, position, clear, text)
+"""
+def compose_frame(frame, items):
+    frame = [list(row) for row in frame]
+    for line, position, clear, text in items:
+        # Clear action: 1=clear line;2=clear display
+        if clear == 1:
+            frame[line] = [" "] * LCDCOLUMNS
+        if clear == 2:
+            frame = new_frame(" ")
+        # Text beyond the last column is cut by the bricklet
+        text = text[:LCDCOLUMNS - position]
+        frame[line][position:position + len(text)] = text
+    return frame
+
+"""
+Get the write_line spans required to change the display from the old to the new frame.
+Per line a single span from the first to the last changed cell is used, as the bricklet
+write_line payload has a fixed size of 20 characters, i.e. rewriting unchanged cells in between is free.
+A span is split at cells with unknown (None) content as these can not be written.
+Parameter:
+old - frame on the display
+new - frame to display
+Return:
+list of spans as tuple (line, position, text)
+"""
+def diff_frame(old, new):
+    spans = []
+    for line in range(LCDLINES):
+        oldrow = old[line]
+        newrow = new[line]
+        start = None
+        end = 0
+        for column in range(LCDCOLUMNS):
+            cell = newrow[column]
+            if cell is None:
+                if start is not None:
+                    spans.append((line, start, "".join(newrow[start:end])))
+                    start = None
+            elif cell != oldrow[column]:
+                if start is None:
+                    start = column
+                end = column + 1
+        if start is not None:
+            spans.append((line, start, "".join(newrow[start:end])))
+    return spans
+
+"""
+Check if all cells of a frame are known.
+"""
+def is_frame_known(frame):
+    return all(cell is not None for row in frame for cell in row)
+
+#
+# Character Translation
+#
+
+# Unicode characters mapped to the LCD charset (KS0066U, like the HD44780 ROM A00), see the Tinkerforge charset specification
+# https://github.com/Tinkerforge/lcd-20x4-bricklet/raw/master/datasheets/standard_charset.pdf
+# The ASCII characters are written unchanged except backslash and tilde, which are not in the LCD charset.
+# The half-width katakana U+FF61-U+FF9F are mapped to 0xA1-0xDF (see build_char_table).
+LCDCHARMAP = {
+    "\\": 0xA4, "~": 0x2D, "\u00A5": 0x5C, "\u2192": 0x7E, "\u2190": 0x7F, "\u00B7": 0xA5,
+    "\u00B0": 0xDF, "\u03B1": 0xE0, "\u00E4": 0xE1, "\u00C4": 0xE1, "\u00DF": 0xE2, "\u03B2": 0xE2, "\u03B5": 0xE3,
+    "\u00B5": 0xE4, "\u03BC": 0xE4, "\u03C3": 0xE5, "\u03C1": 0xE6, "\u221A": 0xE8, "\u00B9": 0xE9, "\u00A4": 0xEB,
+    "\u00A2": 0xEC, "\u00A3": 0xED, "\u00F1": 0xEE, "\u00F6": 0xEF, "\u00D6": 0xEF, "\u03B8": 0xF2, "\u03F4": 0xF2, "\u221E": 0xF3,
+    "\u03A9": 0xF4, "\u2126": 0xF4, "\u00FC": 0xF5, "\u00DC": 0xF5, "\u03A3": 0xF6, "\u03C0": 0xF7, "\u00F7": 0xFD,
+    "\u25A0": 0xFF, "\u2588": 0xFF,
+}
+
+"""
+Translation table (str.translate) from Unicode to the LCD charset.
+Characters not in the table and not in the LCD charset (code point > 0xFF) are displayed as LCDCHARUNKNOWN.
+These are added to the table on first use, i.e. the next translation is a table lookup only.
+"""
+class LCDCharTable(dict):
+
+    def __missing__(self, codepoint):
+        self[codepoint] = LCDCHARUNKNOWN
+        return LCDCHARUNKNOWN
+
+"""
+Build the translation table once when the plugin is loaded.
+The printable ASCII characters and the custom characters U+0008-U+000F used by existing scripts are written unchanged.
+The Latin-1 letters not mapped by LCDCHARMAP are written as their ASCII base letter, i.e. é as e (see get_ascii_fallback).
+The glyphs of the library (GLYPHVIRTUAL0) are kept.
+"""
+def build_char_table():
+    table = LCDCharTable((codepoint, codepoint) for codepoint in range(0x20, 0x7F))
+    for codepoint in range(LCDCHARCUSTOM0, LCDCHARCUSTOM0 + 8):
+        table[codepoint] = codepoint
+    for codepoint in range(0xA0, 0x100):
+        fallback = get_ascii_fallback(chr(codepoint))
+        if fallback is not None:
+            table[codepoint] = ord(fallback)
+    # The glyphs of the library are mapped to the custom characters when the frame is submitted (see allocate_glyphs)
+    for codepoint in range(GLYPHVIRTUAL0, GLYPHVIRTUAL0 + GLYPHLIBRARYSIZE):
+        table[codepoint] = codepoint
+    for codepoint in range(0xFF61, 0xFFA0):
+        table[codepoint] = codepoint - 0xFEC0
+    for char, code in LCDCHARMAP.items():
+        table[ord(char)] = code
+    return table
+
+"""
+Get the ASCII character of a Latin-1 letter or digit without its accents, i.e. e for é, or a space for the no-break space.
+Return:
+ASCII character or None if there is none
+"""
+def get_ascii_fallback(char):
+    if unicodedata.category(char) == "Zs":
+        return " "
+    base = "".join(c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c))
+    if len(base) == 1 and base < "\u0080" and base.isalnum():
+        return base
+    return None
+
+LCDCHARTABLE = build_char_table()
+
+# Translation table (bytes.translate) of the binary ingress text in the LCD charset: the codes 0x00-0x07 are written as
+# the custom characters 0x08-0x0F (same CGRAM characters), as the bricklet ends the text at 0x00 and 0x00 is STATEUNKNOWNCELL.
+LCDBINARYTABLE = bytes.maketrans(bytes(range(LCDCHARCUSTOM0)), bytes(range(LCDCHARCUSTOM0, LCDCHARCUSTOM0 * 2)))
+
+"""
+Set the glyph tokens {name} of the custom characters, e.g. {battery} for the custom character with name battery,
+and the glyph library with the built-in glyphs and the glyphs without custom character id.
+Parameter:
+names - dict name -> custom character id
+library - list of glyphs without custom character id as tuple (name, character)
+"""
+def set_glyphs(self, names, library):
+    if len(BUILTINGLYPHS) + len(library) > GLYPHLIBRARYSIZE:
+        Domoticz.Error("Customchar: Max %d glyphs without id." % (GLYPHLIBRARYSIZE - len(BUILTINGLYPHS)) )
+        library = library[:GLYPHLIBRARYSIZE - len(BUILTINGLYPHS)]
+    self.glyphLibrary = BUILTINGLYPHS + library
+    self.glyphs = {name: chr(GLYPHVIRTUAL0 + len(BUILTINGLYPHS) + index) for index, (name, char) in enumerate(library)}
+    self.glyphs.update((name, chr(LCDCHARCUSTOM0 + id)) for name, id in names.items())
+    # The cached line items are encoded using the previous glyphs
+    self.parseCache.clear()
+    if len(self.glyphs) == 0:
+        self.glyphPattern = None
+        return
+    # Longest names first to match {clock2} before {clock}
+    tokens = sorted(self.glyphs, key=len, reverse=True)
+    self.glyphPattern = re.compile(r"\{(" + "|".join(re.escape(name) for name in tokens) + r")\}")
+    Domoticz.Debug("Customchar: Glyphs=%s" % (",".join("{%s}" % (name) for name in tokens)) )
+
+"""
+Encode a text for the display: replace the glyph tokens by the custom characters and translate the text to the LCD charset.
+Both are a single pass over the text, there is no processing per character in Python.
+The returned text has a character per display cell, i.e. holds the LCD charset codes as written by the bricklet binding.
+"""
+def encode_text(self, text):
+    if self.glyphPattern is not None:
+        text = self.glyphPattern.sub(lambda match: self.glyphs[match.group(1)], text)
+    return text.translate(LCDCHARTABLE)
+
 """
 Set LCD text for the 4 lines and 20 columns using json.
 Parameter:
@@ -448,73 +1069,1748 @@ jsonarraystring = '
     {"line":2,"position":0,"clear":1,"text":"TEXT 3"},
     {"line":3,"position":0,"clear":1,"text":"TEXT 4"}
 ]'
+
+The line items are not written one by one. The frame resulting from all line items (incl. the clear actions)
+is composed first and submitted to the writer thread, which compares it with its shadow framebuffer holding
+the display content. Only the changed spans are written to the bricklet (see LCDWriter.write_frame).
 """
 def write_lines(self,unit):
     Domoticz.Debug("write_lines: Unit=%d,ID=%d,JSON=%s" % (unit, Devices[unit].ID, Devices[unit].sValue) )
-    EMPTYLINE = "                    "
+    display, displayunit = get_display_unit(self, unit)
+    if display is None:
+        write_to_log(STATUSLEVELERROR, MSGERRNOTSTARTED)
+        return
+    if displayunit != UNITJSON:
+        return
     jsonstring = Devices[unit].sValue
     if len(jsonstring) == 0:
         write_to_log(STATUSLEVELERROR,"No JSON string defined for the text device (Unit sValue empty).")
         return
+    write_json_lines(self, display, jsonstring, "Unit=%d,ID=%d" % (unit, Devices[unit].ID))
+
+"""
+Write the line items of a JSON array string (see write_lines).
+Parameter:
+display - LCDDisplay written if the JSON string does not select the display
+jsonstring - JSON array string with the line items or JSON object {"display":n,"lines":[line items]}
+source - source of the JSON string for the error message, i.e. the text device or the ingress client
+"""
+def write_json_lines(self, display, jsonstring, source):
+    start = time.perf_counter()
     try:
-        # Define the lcd function write_line parameter
-        line = 0
-        position = 0
-        text = ""
-        clear = 0
-        # parse the json string
-        json_array = json.loads(jsonstring, encoding=None)
-        Domoticz.Debug("write_lines: Lines: %d" % (len(json_array)) )
-        for item in json_array:
-            line = int(item["line"])
-            position = int(item["position"])
+        display, items, calls = parse_line_items(self, display, jsonstring)
+    except ValueError as e:
+        write_to_log(STATUSLEVELERROR, "write_lines: Failed writing text (%s,JSON=%s). %s" % (source, jsonstring, e) )
+        return
+    self.metrics.count("updates")
+    self.metrics.observe("parse", time.perf_counter() - start)
+    if submit_items(self, display, items, calls):
+        wake_backlight(self, display)
+        Domoticz.Debug("write_lines: OK (Queued)")
+    else:
+        Domoticz.Debug("write_lines: OK (No changes)")
+    return
+
+"""
+Parse and check all line items of a JSON array string prior writing, i.e. a wrong line item does not
+result in a partly updated display. The parsed line items are cached (LRU, PARSECACHESIZE) as scripts
+often send the same JSON string again, i.e. a cached JSON string is neither parsed nor checked again.
+Line items with a width are fields, i.e. the text is aligned and padded to the width (see fit_text).
+Line items with "bar" (and "max") are bar gauges, line items with "big" (and "size") big numerals (see render_bar, render_big).
+A line item with "define" defines a named region (line, position, width, align, pad) of the display, updated by
+line items with "region" and the text. Defining regions changing a region clears the cache, as the cached line items
+of region updates hold the region.
+Parameter:
+display - LCDDisplay written if the JSON string does not select the display
+jsonstring - JSON array string with the line items or JSON object {"display":n,"replace":1,"lines":[line items]}
+Return:
+tuple (LCDDisplay, tuple of line items as tuple (line, position, clear, text), number of bricklet calls if written one by one)
+Raise:
+ValueError - JSON string or line item not valid
+"""
+def parse_line_items(self, display, jsonstring):
+    key = hashlib.sha1(("%d:%s" % (display.index, jsonstring)).encode("utf-8", "replace")).digest()
+    parsed = self.parseCache.get(key)
+    if parsed is not None:
+        self.parseCache.move_to_end(key)
+        self.metrics.count("cached")
+        return parsed
+    json_array = json.loads(jsonstring)
+    replace = False
+    if isinstance(json_array, dict):
+        try:
+            index = int(json_array.get("display", display.index))
+            replace = int(json_array.get("replace", 0)) == 1
+            json_array = json_array["lines"]
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("JSON object with lines and optional display, replace expected.")
+        if index < 0 or index >= len(self.displays):
+            raise ValueError("Wrong display: %d. Ensure 0-%d." % (index, len(self.displays) - 1))
+        display = self.displays[index]
+    if not isinstance(json_array, list):
+        raise ValueError("JSON array expected.")
+    items = []
+    # Number of bricklet calls if each line item is written (incl. clear)
+    calls = 0
+    # Replace the display content: the line items are composed on a cleared display
+    if replace:
+        items.append((0, 0, 2, ""))
+        calls += 1
+    # Regions defined by the line items: name -> (line, position, width, align, pad)
+    regions = {}
+    for item in json_array:
+        if not isinstance(item, dict):
+            raise ValueError("Wrong line item %s. Ensure line, position, clear and text." % (item))
+        if "region" in item:
+            name = str(item["region"])
+            region = regions.get(name, display.regions.get(name))
+            if region is None or "text" not in item:
+                raise ValueError("Wrong region item %s. Ensure a defined region and text." % (item))
+            line, position, width, align, pad = region
+            clear = 0
             text = item["text"]
-            clear = int(item["clear"])
-            # Domoticz.Debug("write_lines: Items (l,p,t,c): %d,%d,%s,%d" % (line,position,text,clear) )
+        else:
+            try:
+                line = int(item["line"])
+                position = int(item["position"])
+                clear = int(item.get("clear", 0))
+                width = int(item["width"]) if "width" in item else None
+                align = item.get("align", "left")
+                pad = encode_text(self, str(item.get("pad", " ")))
+                text = item.get("text") if "define" in item or "bar" in item or "big" in item else item["text"]
+            except (KeyError, TypeError, ValueError, AttributeError):
+                raise ValueError("Wrong line item %s. Ensure line, position, clear and text." % (item))
             # Checks
             if (line < 0 or line > 3):
-                write_to_log(STATUSLEVELERROR, "write_lines: Wrong line number: %d. Ensure 0-3." % (line) )
-                return
+                raise ValueError("Wrong line number: %d. Ensure 0-3." % (line))
             if (position < 0 or position > 19):
-                write_to_log(STATUSLEVELERROR, "write_lines: Wrong position number: %d. Ensure 0-19." % (position) )
+                raise ValueError("Wrong position number: %d. Ensure 0-19." % (position))
+            if (clear < 0 or clear > 2):
+                raise ValueError("Wrong clear: %d. Ensure 0-2." % (clear))
+            if width is not None and (width < 1 or width > LCDCOLUMNS - position):
+                raise ValueError("Wrong width: %d. Ensure 1-%d." % (width, LCDCOLUMNS - position))
+            if align not in TEXTALIGNS or len(pad) != 1:
+                raise ValueError("Wrong align or pad: %s,%s. Ensure %s and a single character." % (align, pad, ",".join(TEXTALIGNS)))
+            if "define" in item:
+                if width is None:
+                    raise ValueError("Wrong region %s. Ensure a width." % (item["define"]))
+                regions[str(item["define"])] = (line, position, width, align, pad)
+                # A region defined without text is not written
+                if text is None:
+                    continue
+            if "bar" in item:
+                try:
+                    value = float(item["bar"])
+                    maximum = float(item.get("max", 100))
+                except (TypeError, ValueError):
+                    raise ValueError("Wrong bar item %s. Ensure a number for bar and max." % (item))
+                items.append((line, position, clear, render_bar(value, maximum, width or LCDCOLUMNS - position)))
+                calls += 2 if clear in (1, 2) else 1
+                continue
+            if "big" in item:
+                size = int(item.get("size", 2)) if str(item.get("size", 2)).isdigit() else 0
+                if size not in BIGFONTS or line + size > LCDLINES:
+                    raise ValueError("Wrong big item %s. Ensure size 2 (line 0-2) or 4 (line 0)." % (item))
+                error = check_big_slots(self, size)
+                if error is not None:
+                    raise ValueError("Wrong big item %s. %s" % (item, error))
+                for row, text in enumerate(render_big(str(item["big"]), size)):
+                    # Clear display before the first row, clear line per row
+                    rowclear = clear if clear == 1 or row == 0 else 0
+                    items.append((line + row, position, rowclear, text if width is None else fit_text(text, width, align, pad)))
+                    calls += 2 if rowclear in (1, 2) else 1
+                continue
+        if not isinstance(text, str):
+            text = str(text)
+        text = encode_text(self, text)
+        if width is not None:
+            text = fit_text(text, width, align, pad)
+        items.append((line, position, clear, text))
+        calls += 2 if clear in (1, 2) else 1
+    # The regions are defined once all line items are valid
+    changed = {name: region for name, region in regions.items() if display.regions.get(name) != region}
+    if len(changed) > 0:
+        display.regions.update(changed)
+        self.parseCache.clear()
+        Domoticz.Debug("write_lines: Display %d regions defined: %s" % (display.index, ",".join(sorted(changed))) )
+    parsed = (display, tuple(items), calls)
+    self.parseCache[key] = parsed
+    if len(self.parseCache) > PARSECACHESIZE:
+        self.parseCache.popitem(last=False)
+    return parsed
+
+"""
+Fit a text to a field width: cut if longer, else aligned and padded.
+Parameter:
+text - text (LCD characters)
+width - field width
+align - left, right or center
+pad - padding character
+"""
+def fit_text(text, width, align, pad):
+    if len(text) >= width:
+        return text[:width]
+    if align == "right":
+        return text.rjust(width, pad)
+    if align == "center":
+        return text.center(width, pad)
+    return text.ljust(width, pad)
+
+"""
+Compose the frame resulting from the line items and hand it over to the writer thread, which writes the changed spans.
+Parameter:
+display - LCDDisplay
+items - list of validated line items as tuple (line, position, clear, text)
+calls - number of bricklet calls if the line items would have been written one by one
+priority - writer job priority, PRIORITYHIGH for alert screens
+Return:
+True if the frame changed and is submitted
+"""
+def submit_items(self, display, items, calls, priority=PRIORITYNORMAL):
+    frame = compose_frame(display.frame, items)
+    if frame == display.frame:
+        display.lcdWriter.count_skipped(calls)
+        return False
+    physical = allocate_glyphs(self, display, frame)
+    display.frame = frame
+    display.lcdWriter.submit_frame(physical, calls, priority)
+    return True
+
+#
+# Glyphs
+#
+
+"""
+Map the library glyphs of a frame to the custom character slots of the display. Called before a frame is submitted.
+A glyph keeps its slot while used. A glyph not yet in a slot gets a free slot (preferably one holding its bitmap already),
+else the slot of the least recently used glyph not on the display (see get_glyph_slot).
+Only the bitmaps of newly allocated glyphs are uploaded. The uploads are written before the frame (PRIORITYHIGH).
+The slots of the characters with id (customchar.json) are not used. A glyph without free slot is displayed as full block.
+Parameter:
+display - LCDDisplay
+frame - frame with library glyphs (GLYPHVIRTUAL0)
+Return:
+frame with the custom characters of the display
+"""
+def allocate_glyphs(self, display, frame):
+    first = chr(GLYPHVIRTUAL0)
+    glyphs = set(cell for row in frame for cell in row if cell is not None and cell >= first)
+    if len(glyphs) == 0:
+        return frame
+    needed = set(ord(cell) - GLYPHVIRTUAL0 for cell in glyphs)
+    displayed = set(ord(cell) - GLYPHVIRTUAL0 for row in display.frame for cell in row if cell is not None and cell >= first)
+    mapping = {}
+    for cell in sorted(glyphs):
+        index = ord(cell) - GLYPHVIRTUAL0
+        slot = display.glyphSlots.get(index)
+        if slot is None and index < len(self.glyphLibrary):
+            slot = get_glyph_slot(self, display, self.glyphLibrary[index][1], needed, displayed)
+        if slot is None:
+            self.metrics.count("glyphmisses")
+            mapping[cell] = chr(LCDCHARBLOCK)
+            continue
+        display.glyphSlots[index] = slot
+        display.glyphSlots.move_to_end(index)
+        char = self.glyphLibrary[index][1]
+        if display.customChars.get(slot) != char:
+            display.customChars[slot] = char
+            display.lcdWriter.submit("char%d" % (slot), display.lcdWriter.apply_custom_character, slot, char, priority=PRIORITYHIGH)
+            self.metrics.count("glyphs")
+        mapping[cell] = chr(LCDCHARCUSTOM0 + slot)
+    return [[mapping.get(cell, cell) for cell in row] for row in frame]
+
+"""
+Get a custom character slot for a glyph: a free slot, else the slot of the least recently used glyph not displayed,
+else the slot of the least recently used glyph displayed but not in the new frame (replaced as soon as the frame is written).
+Parameter:
+char - bitmap of the glyph
+needed - glyph indexes of the new frame
+displayed - glyph indexes of the frame displayed
+Return:
+slot 0-7 or None if all slots are used by the new frame
+"""
+def get_glyph_slot(self, display, char, needed, displayed):
+    taken = set(display.glyphSlots.values()) | self.pinnedSlots
+    free = [slot for slot in range(GLYPHSLOTS) if slot not in taken]
+    if len(free) > 0:
+        for slot in free:
+            if display.customChars.get(slot) == char:
+                return slot
+        return free[0]
+    for used in (needed | displayed, needed):
+        for index, slot in display.glyphSlots.items():
+            if index not in used:
+                del display.glyphSlots[index]
+                return slot
+    return None
+
+"""
+Render a horizontal bar gauge with 5 steps per cell: full blocks, a partial glyph (bar1-bar4) and spaces.
+A bar uses max a single glyph, i.e. a custom character slot.
+Parameter:
+value - value, cut to 0-maximum
+maximum - value of the full bar
+width - bar width (cells)
+"""
+def render_bar(value, maximum, width):
+    steps = width * 5
+    columns = int(round(min(max(value / float(maximum), 0), 1) * steps)) if maximum > 0 else 0
+    text = chr(LCDCHARBLOCK) * (columns // 5)
+    if columns % 5 > 0:
+        text += BUILTINGLYPH["bar%d" % (columns % 5)]
+    return text.ljust(width)
+
+"""
+Render a text as big numerals. Supported are the digits, space, minus, point and colon. Other characters are skipped.
+The characters are separated by an empty column.
+Parameter:
+text - text to render
+size - rows: 2 (3x2 cells per digit, 3 glyphs) or 4 (3x4 cells per digit, 2 glyphs)
+Return:
+list of size texts, one per row
+"""
+def render_big(text, size):
+    font = BIGFONTS[size]
+    rows = [[] for row in range(size)]
+    for char in text:
+        cells = font.get(char)
+        if cells is None:
+            continue
+        for row in range(size):
+            rows[row].append(cells[row])
+    return ["".join(BIGCODES[code] for code in " ".join(row)) for row in rows]
+
+"""
+Build the 4 rows big numerals from the half rows definition BIGFONT4PIXELS.
+"""
+def build_big_font4():
+    font = {}
+    for char, pixels in BIGFONT4PIXELS.items():
+        halfrows = pixels.split(" ")
+        cells = []
+        for row in range(4):
+            upper, lower = halfrows[row * 2], halfrows[row * 2 + 1]
+            cells.append("".join({(True, True): "#", (True, False): "^", (False, True): "_", (False, False): " "}[(u == "#", l == "#")] for u, l in zip(upper, lower)))
+        font[char] = tuple(cells)
+    return font
+
+BIGFONTS = {2: BIGFONT2, 4: build_big_font4()}
+# Number of glyphs (custom character slots) used by the big numerals per size
+BIGFONTGLYPHS = {size: len(set(code for cells in font.values() for row in cells for code in row) - {" ", "#"}) for size, font in BIGFONTS.items()}
+
+"""
+Check if the custom character slots not used by the characters with id can hold the glyphs of the big numerals.
+Return:
+None if the slots can hold the glyphs, else the error text
+"""
+def check_big_slots(self, size):
+    free = GLYPHSLOTS - len(self.pinnedSlots)
+    if BIGFONTGLYPHS[size] > free:
+        return "Big size %d needs %d custom characters, %d are free. Remove the id of characters not used by scripts (customchar.json)." % (size, BIGFONTGLYPHS[size], free)
+    return None
+
+#
+# State Journal
+#
+
+"""
+Save the display content (frame per display UID) and the named regions to the state journal STATEFILE, restored on the next start.
+The file is written if the content changed, max every STATEWRITEINTERVAL seconds to spare the SD card.
+The file is written atomically, i.e. to a temporary file replacing the journal, so a crash does not leave a partial file.
+The backlight, cursor and blinking are kept by the switch devices and the custom characters by the file CUSTOMCHARFILE, i.e. are not journaled.
+Parameter:
+force - True to write without waiting for STATEWRITEINTERVAL (plugin stop)
+"""
+def save_state(self, force=False):
+    if not force and time.time() - self.stateTime < STATEWRITEINTERVAL:
+        return
+    self.stateTime = time.time()
+    displays = {}
+    regions = {}
+    for display in self.displays:
+        if len(display.regions) > 0:
+            regions[display.uid] = display.regions
+        # A display without known content keeps the content of the last run
+        if all(cell is None for row in display.frame for cell in row):
+            continue
+        displays[display.uid] = ["".join(STATEUNKNOWNCELL if cell is None else cell for cell in row) for row in display.frame]
+    if len(displays) == 0 and len(regions) == 0:
+        return
+    content = json.dumps({"displays": displays, "regions": regions}, sort_keys=True)
+    if content == self.stateContent:
+        return
+    try:
+        temp = STATEFILE + ".tmp"
+        with open(temp, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, STATEFILE)
+        self.stateContent = content
+        Domoticz.Debug("State: Saved %d displays to file=%s." % (len(displays), STATEFILE) )
+    except OSError as e:
+        Domoticz.Error("State: Can not write file=%s (%s)." % (STATEFILE, e) )
+
+"""
+Restore the display content and regions saved by save_state. The frame of a display is submitted as first frame, i.e. written
+by the writer thread as soon as connected with a single write per line. The journal is optional.
+"""
+def restore_state(self):
+    try:
+        with open(STATEFILE) as f:
+            content = f.read()
+        state = json.loads(content)
+        displays = state["displays"]
+        regions = state.get("regions", {})
+    except OSError:
+        return
+    except (ValueError, KeyError, TypeError) as e:
+        Domoticz.Error("State: Wrong state in file=%s (%s)." % (STATEFILE, e) )
+        return
+    self.stateContent = content
+    restored = 0
+    for display in self.displays:
+        try:
+            display.regions = {name: tuple(region) for name, region in regions.get(display.uid, {}).items()}
+        except (AttributeError, TypeError):
+            Domoticz.Error("State: Wrong regions of UID=%s in file=%s." % (display.uid, STATEFILE) )
+        rows = displays.get(display.uid)
+        if not isinstance(rows, list) or len(rows) != LCDLINES or any(not isinstance(row, str) or len(row) != LCDCOLUMNS for row in rows):
+            continue
+        frame = [[None if cell == STATEUNKNOWNCELL else cell for cell in row] for row in rows]
+        physical = allocate_glyphs(self, display, frame)
+        display.frame = frame
+        display.lcdWriter.submit_frame(physical, 0)
+        restored += 1
+    Domoticz.Debug("State: Restored %d displays from file=%s." % (restored, STATEFILE) )
+
+#
+# Ingress
+#
+
+"""
+Start the UDP and TCP listeners on the ingress port (Parameter Mode3), if set.
+Scripts can send the line items directly to the plugin instead of updating the JSON text device,
+i.e. without database write, device log entry and onDeviceModified. Example sending a JSON array via UDP:
+echo '[{"line":0,"position":0,"clear":1,"text":"Hello"}]' > /dev/udp/127.0.0.1/4224
+"""
+def start_ingress(self):
+    port = Parameters.get("Mode3", "").strip()
+    if len(port) == 0:
+        return
+    try:
+        if not 0 < int(port) < 65536:
+            raise ValueError
+    except ValueError:
+        Domoticz.Error("Ingress: Wrong port=%s. Ensure 1-65535 or empty." % (port) )
+        return
+    self.ingressUDP = Domoticz.Connection(Name="IngressUDP", Transport="UDP/IP", Protocol="None", Address=INGRESSADDRESS, Port=port)
+    self.ingressUDP.Listen()
+    self.ingressTCP = Domoticz.Connection(Name="IngressTCP", Transport="TCP/IP", Protocol="None", Address=INGRESSADDRESS, Port=port)
+    self.ingressTCP.Listen()
+    Domoticz.Log("Ingress: Listening on %s:%s (UDP,TCP)." % (INGRESSADDRESS, port) )
+
+def ingress_client(Connection):
+    return "%s:%s" % (Connection.Address, Connection.Port)
+
+"""
+Handle data received by the ingress listeners. A UDP datagram holds one or more messages,
+TCP data is buffered per client until a message is complete.
+"""
+def handle_ingress(self, Connection, Data):
+    if len(self.displays) == 0:
+        return
+    client = ingress_client(Connection)
+    final = Connection.Name == "IngressUDP"
+    data = Data if final else self.ingressBuffers.get(client, b"") + Data
+    messages, rest = split_ingress(data, final)
+    if len(rest) > INGRESSMAXSIZE:
+        Domoticz.Error("Ingress: Client=%s message exceeds %d bytes. Data dropped." % (client, INGRESSMAXSIZE) )
+        rest = b""
+    if not final:
+        self.ingressBuffers[client] = rest
+    for message in messages:
+        self.metrics.count("ingress")
+        if message[0] == INGRESSBINARY:
+            write_binary_lines(self, message, "Ingress=" + client)
+        else:
+            # Written to the first display if the JSON message does not select the display
+            write_json_lines(self, self.displays[0], message.decode("utf-8", "replace"), "Ingress=" + client)
+
+"""
+Split the data received into messages.
+JSON message: JSON array of line items or JSON object with display and line items as for the JSON text device,
+terminated by newline (optional for UDP).
+Binary message: byte INGRESSBINARY, display, number of items, per item the bytes line, position, clear, text length
+followed by the text in the LCD charset (no translation, the custom characters are 0x08-0x0F).
+Example writing "12:00" at line 0 position 15 of the first display: 00 00 01 00 0F 00 05 31 32 3A 30 30
+Parameter:
+data - bytes received
+final - True if the data is complete (UDP datagram), i.e. a JSON message without newline is complete
+Return:
+tuple (list of messages as bytes, rest of the data not complete)
+"""
+def split_ingress(data, final):
+    messages = []
+    while len(data) > 0:
+        if data[0] == INGRESSBINARY:
+            end = binary_message_end(data)
+            if end is None:
+                if final:
+                    Domoticz.Error("Ingress: Binary message incomplete. Data dropped.")
+                    return messages, b""
+                break
+            messages.append(data[:end])
+            data = data[end:]
+            continue
+        end = data.find(b"\n")
+        if end == -1:
+            if not final:
+                break
+            end = len(data)
+        if len(data[:end].strip()) > 0:
+            messages.append(data[:end])
+        data = data[end + 1:]
+    return messages, data
+
+"""
+Get the length of the binary message at the start of the data or None if not complete.
+"""
+def binary_message_end(data):
+    if len(data) < 3:
+        return None
+    end = 3
+    for item in range(data[2]):
+        if len(data) < end + 4:
+            return None
+        end += 4 + data[end + 3]
+    return end if len(data) >= end else None
+
+"""
+Write the line items of a binary ingress message (see split_ingress).
+"""
+def write_binary_lines(self, message, source):
+    if message[1] >= len(self.displays):
+        write_to_log(STATUSLEVELERROR, "write_lines: Wrong display: %d (%s). Ensure 0-%d." % (message[1], source, len(self.displays) - 1) )
+        return
+    display = self.displays[message[1]]
+    items = []
+    calls = 0
+    offset = 3
+    for item in range(message[2]):
+        line, position, clear, length = message[offset:offset + 4]
+        text = message[offset + 4:offset + 4 + length].translate(LCDBINARYTABLE).decode("latin-1")
+        offset += 4 + length
+        if line > 3 or position > 19:
+            write_to_log(STATUSLEVELERROR, "write_lines: Wrong line or position: %d,%d (%s). Ensure 0-3,0-19." % (line, position, source) )
+            return
+        if clear > 2:
+            write_to_log(STATUSLEVELERROR, "write_lines: Wrong clear: %d (%s). Ensure 0-2." % (clear, source) )
+            return
+        items.append((line, position, clear, text))
+        calls += 2 if clear in (1, 2) else 1
+    self.metrics.count("updates")
+    if submit_items(self, display, items, calls):
+        wake_backlight(self, display)
+
+#
+# Screens
+#
+
+"""
+Load the screen templates from the JSON array file as defined by constant SCREENFILE.
+The screens are rendered by the plugin heartbeat, i.e. no dzVents script is required to update the display.
+The file is read at plugin start and read again by the heartbeat if the file modification time changed.
+The file is optional. If not found, no screens are rendered.
+JSON format example with a screen showing the CPU temperature (device idx 12) and the time:
+[
+    {"name":"monitor","lines":[
+        {"line":0,"position":0,"clear":1,"text":"CPU {device:12:Temp} \u00B0C"},
+        {"line":3,"position":15,"clear":0,"text":"{time:%H:%M}"}
+    ]}
+]
+The line items have the same keys as the line items of the JSON text device.
+The text can have placeholders, which are replaced when rendering:
+{time} or {time:format} - Current time. Format see Python strftime, default %H:%M.
+{device:idx} or {device:idx:key} - Value of the Domoticz device idx. Key of the Domoticz JSON API device result, default Data.
+The device values are requested via the Domoticz JSON API, see DOMOTICZHOST and DOMOTICZPORT.
+The templates are compiled when loaded, i.e. the text is split into literal text and placeholders.
+Screen keys (optional):
+"dwell":seconds - Time the screen is displayed before the next screen is displayed. Default SCREENDWELL.
+"when":"template" - Alert screen, displayed if the rendered template is not empty, 0, Off or False. Not part of the rotation.
+"priority":n - Priority of the alert screen. The active alert screen with the highest priority is displayed.
+"display":n - Display (0-based, see Parameter Mode1) the screen is displayed on. Default 0.
+Line item keys (optional):
+"marquee":1 - Scroll the text if longer than the width, one character per heartbeat.
+"width":n - Width of the text. Default up to the end of the line.
+"align":"left|right|center" - Align and pad the text to the width, i.e. a field. Default none (the text is only cut).
+"pad":"c" - Padding character of an aligned text. Default space.
+"bar":"template" - Bar gauge of the first number of the rendered template instead of the text, "max":n - value of the full bar, default 100.
+"big":"template" - Big numerals of the rendered template instead of the text, "size":2|4 - rows, default 2.
+"""
+def load_screens(self):
+    try:
+        mtime = path.getmtime(SCREENFILE)
+    except OSError:
+        if self.screenTime is not None and self.screenTime != -1:
+            Domoticz.Log("Screens: File=%s removed." % (SCREENFILE) )
+            self.screens = []
+        self.screenTime = -1
+        return
+    if mtime == self.screenTime:
+        return
+    self.screenTime = mtime
+    try:
+        with open(SCREENFILE) as f:
+            json_screen_array = json.load(f)
+        screens = []
+        devices = set()
+        for screen in json_screen_array:
+            items = []
+            for item in screen["lines"]:
+                line = int(item["line"])
+                position = int(item["position"])
+                clear = int(item.get("clear", 0))
+                if (line < 0 or line > 3 or position < 0 or position > 19):
+                    Domoticz.Error("Screens: Screen=%s wrong line or position: %d,%d. Ensure 0-3,0-19." % (screen.get("name"), line, position) )
+                    continue
+                # Bar gauge or big numerals of the rendered template (see render_bar, render_big), else text
+                kind = "bar" if "bar" in item else "big" if "big" in item else None
+                size = int(item.get("size", 2))
+                if kind == "big" and (size not in BIGFONTS or line + size > LCDLINES):
+                    Domoticz.Error("Screens: Screen=%s wrong big size: %d. Ensure 2 (line 0-2) or 4 (line 0)." % (screen.get("name"), size) )
+                    continue
+                if kind == "big" and check_big_slots(self, size) is not None:
+                    Domoticz.Error("Screens: Screen=%s %s" % (screen.get("name"), check_big_slots(self, size)) )
+                    continue
+                parts = compile_template(str(item[kind] if kind is not None else item["text"]))
+                devices.update(part[1] for part in parts if not isinstance(part, str) and part[0] == "device")
+                width = int(item.get("width", LCDCOLUMNS - position))
+                align = item.get("align")
+                if align is not None and align not in TEXTALIGNS:
+                    Domoticz.Error("Screens: Screen=%s wrong align: %s. Ensure %s." % (screen.get("name"), align, ",".join(TEXTALIGNS)) )
+                    align = None
+                items.append({"line": line, "position": position, "clear": clear, "parts": parts,
+                    "marquee": int(item.get("marquee", 0)) == 1, "width": min(max(width, 1), LCDCOLUMNS - position),
+                    "align": align, "pad": (encode_text(self, str(item.get("pad", " "))) + " ")[0],
+                    "kind": kind, "max": float(item.get("max", 100)), "size": size})
+            when = compile_template(screen["when"]) if "when" in screen else None
+            if when is not None:
+                devices.update(part[1] for part in when if not isinstance(part, str) and part[0] == "device")
+            screens.append({"name": screen.get("name", str(len(screens))), "items": items, "display": int(screen.get("display", 0)),
+                "dwell": int(screen.get("dwell", SCREENDWELL)), "when": when, "priority": int(screen.get("priority", 1))})
+    except (ValueError, KeyError, TypeError) as e:
+        Domoticz.Error("Screens: Wrong screen definition in file=%s (%s)." % (SCREENFILE, e) )
+        return
+    self.screens = screens
+    for display in self.displays:
+        display.screenIndex = 0
+        display.screen = None
+    self.screenDevices = sorted(devices)
+    Domoticz.Log("Screens: Loaded %d screens from file=%s." % (len(screens), SCREENFILE) )
+
+# Number of a rendered bar gauge template, i.e. of the device value 21.5 C
+NUMBERPATTERN = re.compile(r"-?\d+(?:\.\d+)?")
+# Placeholders {time}, {time:format}, {device:idx}, {device:idx:key}. Other text in braces is literal text or a glyph token (see encode_text).
+TEMPLATEPLACEHOLDER = re.compile(r"\{(time|device)(?::([^}]*))?\}")
+
+"""
+Compile a template text into a list of parts. A part is either literal text or a placeholder tuple:
+("time", format) or ("device", idx, key).
+"""
+def compile_template(text):
+    parts = []
+    last = 0
+    for match in TEMPLATEPLACEHOLDER.finditer(text):
+        if match.start() > last:
+            parts.append(text[last:match.start()])
+        kind, argument = match.group(1), match.group(2)
+        if kind == "time":
+            parts.append(("time", argument or "%H:%M"))
+        else:
+            idx, sep, key = (argument or "").partition(":")
+            parts.append(("device", int(idx), key or "Data"))
+        last = match.end()
+    if last < len(text):
+        parts.append(text[last:])
+    return parts
+
+"""
+Render a compiled template text.
+Parameter:
+parts - compiled template (see compile_template)
+now - time.localtime() used for the time placeholders
+"""
+def render_template(self, parts, now):
+    text = []
+    for part in parts:
+        if isinstance(part, str):
+            text.append(part)
+        elif part[0] == "time":
+            text.append(time.strftime(part[1], now))
+        else:
+            value = self.deviceValues.get(part[1], {}).get(part[2], "")
+            text.append(str(value))
+    return "".join(text)
+
+"""
+Check if an alert screen is active, i.e. its "when" template renders not empty, 0, Off or False.
+"""
+def is_alert_active(self, screen, now):
+    value = render_template(self, screen["when"], now).strip().lower()
+    return value not in ("", "0", "off", "false")
+
+"""
+Select the screen to display on a display.
+An active alert screen with the highest priority interrupts the rotation. Else the screens (without "when")
+are rotated, each displayed for its dwell time.
+"""
+def select_screen(self, display, now):
+    screens = [screen for screen in self.screens if screen["display"] == display.index]
+    alerts = [screen for screen in screens if screen["when"] is not None and is_alert_active(self, screen, now)]
+    if len(alerts) > 0:
+        return max(alerts, key=lambda screen: screen["priority"])
+    rotation = [screen for screen in screens if screen["when"] is None]
+    if len(rotation) == 0:
+        return None
+    display.screenIndex = display.screenIndex % len(rotation)
+    screen = rotation[display.screenIndex]
+    # Next screen if the dwell time of the screen displayed has passed
+    if screen is display.screen and time.time() - display.screenStart >= screen["dwell"] and len(rotation) > 1:
+        display.screenIndex = (display.screenIndex + 1) % len(rotation)
+        screen = rotation[display.screenIndex]
+    return screen
+
+"""
+Get the visible part of a marquee text scrolled by the number of heartbeats the screen is displayed.
+Parameter:
+text - rendered text
+width - width of the visible part
+tick - heartbeats since the screen is displayed
+"""
+def scroll_text(text, width, tick):
+    if len(text) <= width:
+        return text
+    loop = text + MARQUEEGAP
+    offset = tick % len(loop)
+    return (loop + loop)[offset:offset + width]
+
+"""
+Render the screen displayed and submit it to the writer thread. Called every heartbeat.
+An unchanged screen results in an unchanged frame, i.e. no bricklet I/O. A scrolling marquee text
+changes a single line span per heartbeat.
+"""
+def render_screen(self):
+    if len(self.screens) == 0:
+        return
+    now = time.localtime()
+    for display in self.displays:
+        render_display_screen(self, display, now)
+
+def render_display_screen(self, display, now):
+    screen = select_screen(self, display, now)
+    if screen is None:
+        return
+    if screen is not display.screen:
+        Domoticz.Debug("Screens: Screen=%s displayed on display %d." % (screen["name"], display.index) )
+        display.screen = screen
+        display.screenStart = time.time()
+        display.screenTick = 0
+        # An alert screen is a content change, the screen rotation is not
+        if screen["when"] is not None:
+            wake_backlight(self, display)
+    else:
+        display.screenTick += 1
+    items = []
+    calls = 0
+    for item in screen["items"]:
+        if item["kind"] == "big":
+            for row, text in enumerate(render_big(render_template(self, item["parts"], now), item["size"])):
+                items.append((item["line"] + row, item["position"], item["clear"] if item["clear"] == 1 or row == 0 else 0, text[:item["width"]]))
+                calls += 1
+            continue
+        if item["kind"] == "bar":
+            match = NUMBERPATTERN.search(render_template(self, item["parts"], now))
+            text = render_bar(float(match.group(0)) if match else 0.0, item["max"], item["width"])
+            items.append((item["line"], item["position"], item["clear"], text))
+            calls += 1
+            continue
+        text = encode_text(self, render_template(self, item["parts"], now))
+        if item["marquee"]:
+            text = scroll_text(text, item["width"], display.screenTick)
+        if item["align"] is not None:
+            text = fit_text(text, item["width"], item["align"], item["pad"])
+        else:
+            text = text[:item["width"]]
+        items.append((item["line"], item["position"], item["clear"], text))
+        calls += 2 if item["clear"] in (1, 2) else 1
+    # Alert screens are written before other pending jobs
+    submit_items(self, display, items, calls, PRIORITYNORMAL if screen["when"] is None else PRIORITYHIGH)
+
+"""
+Request the values of the devices referenced by the screens via the Domoticz JSON API.
+The values are requested one by one using the Domoticz HTTP connection. The result is handled by onMessage.
+"""
+def request_device_values(self):
+    if len(self.screens) == 0 or len(self.screenDevices) == 0:
+        return
+    # Previous requests still pending
+    if len(self.deviceRequests) > 0:
+        return
+    self.deviceRequests = list(self.screenDevices)
+    if self.httpConn is None:
+        self.httpConn = Domoticz.Connection(Name="DomoticzAPI", Transport="TCP/IP", Protocol="HTTP", Address=DOMOTICZHOST, Port=DOMOTICZPORT)
+    if self.httpConn.Connected():
+        request_next_device_value(self)
+    elif not self.httpConn.Connecting():
+        self.httpConn.Connect()
+
+def request_next_device_value(self):
+    if len(self.deviceRequests) == 0 or not self.httpConn.Connected():
+        return
+    idx = self.deviceRequests[0]
+    self.httpConn.Send({"Verb":"GET", "URL":DOMOTICZDEVICEURL % (idx), "Headers":{"Host":DOMOTICZHOST, "Accept":"application/json"}})
+
+"""
+Handle the Domoticz JSON API response for the device requested.
+The value is displayed when the screen is rendered by the next heartbeat.
+"""
+def handle_device_value(self, Data):
+    if len(self.deviceRequests) == 0:
+        return
+    idx = self.deviceRequests.pop(0)
+    try:
+        result = json.loads(Data["Data"].decode("utf-8", "ignore"))["result"][0]
+    except (KeyError, IndexError, ValueError, TypeError):
+        Domoticz.Error("Screens: No value for device idx=%d (Status=%s)." % (idx, Data.get("Status")) )
+        return
+    self.deviceValues[idx] = result
+
+#
+# Device Updates
+#
+
+"""
+Update a Domoticz device if its value changes. Each device update is a database write and runs the Domoticz event system.
+An update not changing nValue and sValue is not made. Updates of a device within DEVICEUPDATEWINDOW of its last update
+are held back and coalesced, i.e. the latest value is set by the heartbeat (see flush_device_updates).
+The updates not made are counted (metric devicesaved).
+Parameter:
+unit - Domoticz unit
+nValue - numeric value
+sValue - string value
+coalesce - False to make each change, i.e. a button press (On, Off) must not be coalesced away
+"""
+def update_device(self, unit, nValue, sValue, coalesce=True):
+    saved = 0
+    # The update held back is replaced
+    if self.deviceUpdates.pop(unit, None) is not None:
+        saved += 1
+    device = Devices[unit]
+    if device.nValue == nValue and device.sValue == sValue:
+        saved += 1
+    elif coalesce and time.time() - self.deviceUpdateTimes.get(unit, 0) < DEVICEUPDATEWINDOW:
+        self.deviceUpdates[unit] = (nValue, sValue)
+    else:
+        apply_device_update(self, unit, nValue, sValue)
+    if saved > 0:
+        self.deviceUpdatesSaved += saved
+        self.metrics.count("devicesaved", saved)
+
+"""
+Make the device updates held back once the coalescing window has passed. Called every heartbeat.
+Parameter:
+force - True to make all device updates held back (plugin stop)
+"""
+def flush_device_updates(self, force=False):
+    now = time.time()
+    for unit, (nValue, sValue) in list(self.deviceUpdates.items()):
+        if force or now - self.deviceUpdateTimes.get(unit, 0) >= DEVICEUPDATEWINDOW:
+            del self.deviceUpdates[unit]
+            if unit in Devices:
+                apply_device_update(self, unit, nValue, sValue)
+
+def apply_device_update(self, unit, nValue, sValue):
+    self.deviceUpdateTimes[unit] = time.time()
+    Devices[unit].Update(nValue=nValue, sValue=sValue)
+
+#
+# Metrics
+#
+
+"""
+Lightweight metrics of the write pipeline, aggregated in memory and published every METRICSINTERVAL (see publish_metrics).
+Counters: updates (JSON updates), cached (JSON updates not parsed, see parse_line_items), ingress (ingress messages), throttled (writer waits for the call budget), skipped (bricklet writes skipped), reconnects,
+devicesaved (Domoticz device updates not made, see update_device), glyphs (library glyphs uploaded), glyphmisses (library glyphs without free slot).
+Values (count, average, max): parse (JSON parse time), calls (bricklet calls per frame), rtt (bricklet call round trip time),
+latency (job latency from submit to written), queue (writer queue depth), downtime (connection downtime).
+Thread safe, used by the plugin thread and the writer thread.
+"""
+class LCDMetrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.values = {}
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        with self.lock:
+            v = self.values.get(name)
+            if v is None:
+                self.values[name] = [1, value, value]
+            else:
+                v[0] += 1
+                v[1] += value
+                v[2] = max(v[2], value)
+
+    """
+    Get the metrics as text and reset the metrics.
+    Times (seconds) are shown in ms as average/max.
+    """
+    def get_summary(self):
+        with self.lock:
+            counters = self.counters
+            values = self.values
+            self.counters = {}
+            self.values = {}
+        text = ["%s=%d" % (name, counters.get(name, 0)) for name in ("updates", "cached", "ingress", "skipped", "throttled", "reconnects", "devicesaved", "glyphs", "glyphmisses")]
+        for name in ("parse", "rtt", "latency", "downtime"):
+            if name in values:
+                count, total, maximum = values[name]
+                text.append("%s=%.1f/%.1fms" % (name, total / count * 1000, maximum * 1000))
+        for name in ("calls", "queue"):
+            if name in values:
+                count, total, maximum = values[name]
+                text.append("%s=%.1f/%d" % (name, total / count, maximum))
+        return ",".join(text)
+
+"""
+Publish the metrics to the debug log and, if created, the metrics text device. Called by the heartbeat.
+"""
+def publish_metrics(self):
+    self.metricsTime = time.time()
+    summary = self.metrics.get_summary()
+    Domoticz.Debug("Metrics: " + summary)
+    if UNITMETRICS in Devices:
+        update_device(self, UNITMETRICS, 0, summary)
+
+#
+# Trace
+#
+
+"""
+Trace of the plugin input, recorded to a JSON lines file to replay the display traffic offline (see bench/replay.py).
+The first line is the header {"version":1,"uids":"Mode1","start":time}. The other lines are events [time, kind, ...]
+with the time (seconds) since the start:
+[t,"device",unit,sValue] - text device modified (onDeviceModified)
+[t,"command",unit,command,level] - switch command (onCommand)
+[t,"button",display,button,state] - button pressed (1) or released (0) (button callbacks)
+[t,"frame",display,lines] - frame of the display when the plugin stops, unknown cells are STATEUNKNOWNCELL
+The events are buffered and written every plugin interval. Thread safe, used by the plugin thread and the button callback thread.
+Parameter:
+filename - trace file, overwritten
+uids - UIDs (Parameter Mode1)
+"""
+class LCDTrace:
+
+    def __init__(self, filename, uids):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.lines = []
+        self.file = open(filename, "w")
+        self.file.write(json.dumps({"version": 1, "uids": uids, "start": self.start}) + "\n")
+
+    def record(self, kind, *args):
+        line = json.dumps([round(time.time() - self.start, 3), kind] + list(args), separators=(",", ":"))
+        with self.lock:
+            self.lines.append(line)
+
+    def flush(self):
+        with self.lock:
+            lines = self.lines
+            self.lines = []
+        if len(lines) > 0:
+            self.file.write("\n".join(lines) + "\n")
+            self.file.flush()
+
+    """
+    Record the frames of the displays, checked by the replay, and close the file.
+    """
+    def close(self, displays):
+        for display in displays:
+            self.record("frame", display.index, ["".join(STATEUNKNOWNCELL if cell is None else cell for cell in row) for row in display.frame])
+        self.flush()
+        self.file.close()
+
+#
+# Displays
+#
+
+"""
+Display state kept by the plugin thread for a LCD 20x4 bricklet.
+The bricklet I/O is done by the writer thread of the display (see class LCDWriter).
+Parameter:
+index - display index 0-MAXDISPLAYS-1, determines the units of the display (see UNITDISPLAYBLOCK)
+uid - bricklet UID
+host - brickd host
+port - brickd port
+"""
+class LCDDisplay:
+
+    def __init__(self, index, uid, host, port):
+        self.index = index
+        self.uid = uid
+        self.host = host
+        self.port = port
+        # Bricklet and writer thread, set on start
+        self.lcdDev = None
+        self.lcdWriter = None
+        # Frame requested by the latest line items (see new_frame). The writer thread keeps the
+        # shadow framebuffer with the characters on the display and writes the changes only.
+        # At plugin start the display content is not known, i.e. all cells are unknown (None).
+        self.frame = new_frame()
+        # Bricklet config set by the switch devices. The writer thread keeps the config of the bricklet.
+        self.backlight = True
+        self.cursor = False
+        # Backlight state submitted to the writer (None=not yet), time of the last content change and button press (see update_backlight)
+        self.backlightOn = None
+        self.activityTime = time.time()
+        self.wakeTime = 0
+        self.blinking = False
+        # Custom characters submitted: id -> character as tuple with 8 integers
+        self.customChars = {}
+        # Custom character slots of the library glyphs: glyph index -> slot, least recently used first (see allocate_glyphs)
+        self.glyphSlots = OrderedDict()
+        # Screen displayed: index in the rotation, screen, start time and heartbeats since displayed (marquee offset)
+        self.screenIndex = 0
+        self.screen = None
+        self.screenStart = 0
+        self.screenTick = 0
+        # Named regions defined by line items: name -> (line, position, width, align, pad) (see parse_line_items)
+        self.regions = {}
+        # Button state: button -> dict (see handle_button_events)
+        self.buttons = {}
+
+    """
+    Get the Domoticz unit of the display for a unit of the first display, i.e. display.unit(UNITJSON).
+    """
+    def unit(self, unit):
+        return self.index * UNITDISPLAYBLOCK + unit
+
+"""
+Parse the displays from the UID parameter (Mode1).
+The UIDs are separated by comma. A UID can have the brickd host and port, else the Host and Port parameters are used.
+Example: BHN,XYZ@192.168.1.20:4223 - display 0 BHN at Host:Port, display 1 XYZ at 192.168.1.20:4223.
+Return:
+list of tuple (uid, host, port)
+"""
+def parse_displays(uids, host, port):
+    displays = []
+    for entry in uids.split(","):
+        entry = entry.strip()
+        if len(entry) == 0:
+            continue
+        uid, sep, address = entry.partition("@")
+        displayhost, sep, displayport = address.partition(":")
+        try:
+            displays.append((uid.strip(), displayhost.strip() or host, int(displayport) if len(displayport.strip()) > 0 else port))
+        except ValueError:
+            Domoticz.Error("Displays: Wrong display %s. Ensure UID or UID@host:port." % (entry) )
+    if len(displays) > MAXDISPLAYS:
+        Domoticz.Error("Displays: Max %d displays supported. Displays %s ignored." % (MAXDISPLAYS, ",".join(display[0] for display in displays[MAXDISPLAYS:])) )
+        displays = displays[:MAXDISPLAYS]
+    return displays
+
+"""
+Create the devices of a display if not exist. The device names of the other displays start with the UID.
+"""
+def create_devices(display):
+    prefix = "" if display.index == 0 else display.uid + " "
+    if display.unit(UNITJSON) not in Devices:
+        # Create new devices for the Hardware
+        Domoticz.Debug("Creating devices")
+        # General;Text
+        Domoticz.Device(Name=prefix + "JSON", Unit=display.unit(UNITJSON), TypeName="Text", Used=1).Create()
+        # Switches for the configuration
+        Domoticz.Device(Name=prefix + "Backlight", Unit=display.unit(UNITBACKLIGHT), TypeName="Switch", Used=1).Create()
+        Devices[display.unit(UNITBACKLIGHT)].Update(nValue=1,sValue="")
+        Domoticz.Device(Name=prefix + "Cursor", Unit=display.unit(UNITCURSOR), TypeName="Switch", Used=1).Create()
+        Domoticz.Device(Name=prefix + "Blinking", Unit=display.unit(UNITBLINKING), TypeName="Switch", Used=1).Create()
+        # Swiches for the push-buttons
+        for button in range(4):
+            Domoticz.Device(Name=prefix + "Button %d" % (button), Unit=display.unit(UNITBUTTON0 + button), TypeName="Switch", Used=1).Create()
+        Domoticz.Debug("Creating device: OK")
+
+    # Push On buttons for the long press, double press and hold repeat button events. Created if not exist.
+    for button in range(4):
+        for unit, name in ((UNITBUTTONLONG0, "Long"), (UNITBUTTONDOUBLE0, "Double"), (UNITBUTTONREPEAT0, "Repeat")):
+            if display.unit(unit + button) not in Devices:
+                Domoticz.Device(Name=prefix + "Button %d %s" % (button, name), Unit=display.unit(unit + button), TypeName="Switch", Switchtype=SWITCHTYPEPUSHON, Used=1).Create()
+                Domoticz.Debug("Device created: "+Devices[display.unit(unit + button)].Name)
+
+"""
+Get the display and the unit of the first display for a Domoticz unit.
+Return:
+tuple (LCDDisplay, unit) or (None, unit) if the unit does not belong to a display
+"""
+def get_display_unit(self, unit):
+    index, displayunit = divmod(unit, UNITDISPLAYBLOCK)
+    if index < len(self.displays) and unit != UNITMETRICS:
+        return self.displays[index], displayunit
+    return None, unit
+
+#
+# IP Connection
+#
+
+"""
+IP connection to brickd with automatic reconnect.
+The connect is done by the writer thread (ensure_connected). If the connect fails or the connection is lost,
+the next attempt is made after a backoff delay, doubled per failed attempt (RECONNECTMINDELAY - RECONNECTMAXDELAY) and jittered.
+After a reconnect, the writers replay their display state. The writers also replay if their bricklet is
+enumerated as connected, i.e. the master brick or bricklet restarted without losing the connection to brickd.
+The reconnect attempts and downtime are counted.
+Parameter:
+host - brickd host
+port - brickd port
+metrics - LCDMetrics
+"""
+class LCDConnection:
+
+    def __init__(self, host, port, metrics):
+        self.host = host
+        self.port = port
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.ipConn = IPConnection()
+        # The reconnect is handled by this class
+        self.ipConn.set_auto_reconnect(False)
+        self.ipConn.register_callback(IPConnection.CALLBACK_CONNECTED, self.onConnected)
+        self.ipConn.register_callback(IPConnection.CALLBACK_DISCONNECTED, self.onDisconnected)
+        self.ipConn.register_callback(IPConnection.CALLBACK_ENUMERATE, self.onEnumerate)
+        self.connected = False
+        self.closed = False
+        # Writers by bricklet UID
+        self.writers = {}
+        # Reconnect backoff
+        self.backoff = 0
+        self.nextAttempt = 0
+        # Statistics
+        self.attempts = 0
+        self.reconnects = 0
+        self.downSince = None
+        self.downtime = 0.0
+
+    def add_writer(self, uid, writer):
+        self.writers[uid] = writer
+
+    """
+    Connect to brickd if not connected and the backoff delay has passed.
+    Return:
+    True if connected
+    """
+    def ensure_connected(self):
+        with self.lock:
+            if self.connected:
+                return True
+            now = time.time()
+            if self.closed or now < self.nextAttempt:
+                return False
+            self.attempts += 1
+            try:
+                self.ipConn.connect(self.host, self.port)
+            except Exception as e:
+                self.backoff = min(self.backoff * 2, RECONNECTMAXDELAY) if self.backoff > 0 else RECONNECTMINDELAY
+                self.nextAttempt = time.time() + self.backoff * random.uniform(0.5, 1.0)
+                if self.downSince is None:
+                    self.downSince = now
+                    Domoticz.Error(MSGERRNOIPCONN + " (%s:%d, %s)" % (self.host, self.port, e) )
+                Domoticz.Debug("LCDConnection: Connect attempt %d failed. Next attempt in %.1fs." % (self.attempts, self.nextAttempt - time.time()) )
+                return False
+            self.connected = True
+            self.backoff = 0
+            if self.downSince is not None:
+                downtime = time.time() - self.downSince
+                self.downtime += downtime
+                self.downSince = None
+                self.reconnects += 1
+                self.metrics.count("reconnects")
+                self.metrics.observe("downtime", downtime)
+                Domoticz.Log("LCDConnection: Reconnected to %s:%d after %.1fs (Attempts=%d)." % (self.host, self.port, downtime, self.attempts) )
+            else:
+                Domoticz.Debug("IP Connection - OK")
+            writers = list(self.writers.values())
+        # The display content is lost or at least not known after a (re)connect
+        for writer in writers:
+            writer.invalidate()
+        return True
+
+    """
+    Get the time (seconds) until the next connect attempt.
+    """
+    def get_retry_delay(self):
+        return max(self.nextAttempt - time.time(), 0.1)
+
+    """
+    Check the connection after a failed bricklet call, i.e. the disconnected callback may not have been called yet.
+    """
+    def check_connected(self):
+        if self.ipConn.get_connection_state() != IPConnection.CONNECTION_STATE_CONNECTED:
+            self.set_disconnected()
+
+    def set_disconnected(self):
+        with self.lock:
+            if not self.connected:
                 return
-            # Clear action: 1=clear line;2=clear display
-            if clear == 1:
-                self.lcdDev.write_line(line, 0, EMPTYLINE)
-            if clear == 2:
-                self.lcdDev.clear_display()
-            # Write text 
-            self.lcdDev.write_line(line, position, text)
-            write_to_log(STATUSLEVELOK, "write_lines: Line=%d,Position=%d,Text=%s" % (line,position,text) )
-        Domoticz.Debug("write_lines: OK")
-    except:
-        write_to_log(STATUSLEVELERROR, "write_lines: Failed writing text (Unit=%d,ID=%d,JSON=%s). Check JSON definition." % (unit, Devices[unit].ID, Devices[unit].sValue) )
-    return
+            self.connected = False
+            self.downSince = time.time()
+            self.nextAttempt = 0
+            writers = list(self.writers.values())
+        Domoticz.Error("LCDConnection: Connection to %s:%d lost. Reconnecting." % (self.host, self.port) )
+        # The writers retry connecting and replay the display state, also if no job is submitted meanwhile
+        for writer in writers:
+            writer.invalidate()
+
+    """
+    Callback function for the ipconnection connected callback (called by the Tinkerforge callback thread).
+    """
+    def onConnected(self, reason):
+        Domoticz.Debug("LCDConnection: Connected to %s:%d (Reason=%d)" % (self.host, self.port, reason) )
+
+    """
+    Callback function for the ipconnection disconnected callback (called by the Tinkerforge callback thread).
+    """
+    def onDisconnected(self, reason):
+        if reason != IPConnection.DISCONNECT_REASON_REQUEST:
+            self.set_disconnected()
+
+    """
+    Callback function for the ipconnection enumerate callback (called by the Tinkerforge callback thread).
+    A bricklet enumerated as connected has been restarted, i.e. lost the display content, config and custom characters.
+    """
+    def onEnumerate(self, uid, connected_uid, position, hardware_version, firmware_version, device_identifier, enumeration_type):
+        if enumeration_type == IPConnection.ENUMERATION_TYPE_CONNECTED and uid in self.writers:
+            Domoticz.Log("LCDConnection: Bricklet %s restarted." % (uid) )
+            self.writers[uid].invalidate()
+
+    """
+    Disconnect, no reconnect.
+    """
+    def close(self):
+        with self.lock:
+            self.closed = True
+            if self.connected:
+                self.connected = False
+                try:
+                    self.ipConn.disconnect()
+                except:
+                    pass
+
+    """
+    Get the connection status (connected, reconnects, attempts, downtime) as text.
+    """
+    def get_status(self):
+        # Not locked as a connect attempt in progress holds the lock
+        downSince = self.downSince
+        downtime = self.downtime + (time.time() - downSince if downSince is not None else 0)
+        return "LCDConnection: %s:%d,Connected=%s,Reconnects=%d,Attempts=%d,Downtime=%.1fs" % (self.host, self.port, self.connected, self.reconnects, self.attempts, downtime)
+
+#
+# LCD Writer
+#
+
+"""
+Writer thread owning all bricklet I/O.
+Every bricklet call is a blocking TCP round trip to brickd. To not block the Domoticz plugin thread,
+the plugin callbacks submit jobs to the bounded queue of the writer thread and return immediately.
+A job has a key. Submitting a job with the key of a pending job replaces the pending job, i.e. the latest wins.
+This applies to the frame (key "frame"), the backlight, cursor etc. as these set a state.
+The writer keeps the shadow framebuffer self.frame with the characters on the display and writes the changed spans only.
+The writer connects to brickd (see LCDConnection). While not connected, the jobs are kept in the queue (coalesced).
+The latest job per key is kept as display state, which is replayed after a reconnect or bricklet restart.
+The pending job with the highest priority is written first (see WRITERPRIORITIES). The bricklet calls are limited
+by a budget (calls per second). While the budget is used up, the jobs are kept in the queue (coalesced), i.e. the
+latency of high priority jobs is bounded by the budget used by a single job.
+Parameter:
+uid - bricklet UID
+lcdDev - bricklet
+connection - LCDConnection used by the bricklet
+metrics - LCDMetrics
+rate - max bricklet calls per second, 0=unlimited
+"""
+class LCDWriter(threading.Thread):
+
+    def __init__(self, uid, lcdDev, connection, metrics, rate):
+        threading.Thread.__init__(self, name="LCDWriter %s" % (uid), daemon=True)
+        self.uid = uid
+        self.lcdDev = lcdDev
+        self.metrics = metrics
+        self.connection = connection
+        self.connection.add_writer(uid, self)
+        self.condition = threading.Condition()
+        # Pending jobs: key -> (submit time, function, args, priority)
+        self.jobs = OrderedDict()
+        # Display state: key -> (function, args, priority) of the latest job submitted
+        self.state = OrderedDict()
+        # Call budget (token bucket), used by the writer thread only
+        self.rate = rate
+        self.tokens = WRITERCALLBURST
+        self.tokenTime = time.time()
+        # Flag to replay the display state
+        self.replay = False
+        self.stopped = False
+        # Flag set while a job is written, i.e. popped from the queue but its bricklet calls not done
+        self.busy = False
+        # Cached bricklet config, seeded when connected. None=unknown.
+        self.config = {"backlight": None, "cursor": None, "blinking": None}
+        self.nextConfigCheck = time.time() + CONFIGCHECKINTERVAL
+        self.configDrifts = 0
+        # Custom characters uploaded to the bricklet: id -> character as tuple with 8 integers
+        self.chars = {}
+        # Shadow framebuffer with the characters on the display, None=unknown
+        self.frame = new_frame()
+        # Statistics
+        self.writesSkipped = 0
+        self.jobsDone = 0
+        self.jobsCoalesced = 0
+        self.jobsDropped = 0
+        self.throttled = 0
+        self.maxDepth = 0
+        self.lastLatency = 0.0
+        self.maxLatency = 0.0
+        self.totalLatency = 0.0
+        # Time the writer is created, until the jobs submitted on start are written
+        self.startTime = time.time()
+
+    """
+    Submit a job. The function is called with the args by the writer thread.
+    If a job with the same key is pending, it is replaced (coalesced), keeping the higher priority and the queue position.
+    If the queue is full, the oldest pending job is dropped.
+    The priority defaults to the priority of the key (see WRITERPRIORITIES).
+    """
+    def submit(self, key, function, *args, priority=None):
+        if priority is None:
+            priority = WRITERPRIORITIES.get(key, PRIORITYNORMAL)
+        with self.condition:
+            pending = self.jobs.get(key)
+            if pending is not None:
+                self.jobsCoalesced += 1
+                priority = min(priority, pending[3])
+            elif len(self.jobs) >= WRITERQUEUESIZE:
+                self.jobs.popitem(last=False)
+                self.jobsDropped += 1
+            self.jobs[key] = (time.time() if pending is None else pending[0], function, args, priority)
+            if key != "configcheck":
+                self.state[key] = (function, args, priority)
+            self.maxDepth = max(self.maxDepth, len(self.jobs))
+            self.metrics.observe("queue", len(self.jobs))
+            self.condition.notify()
+
+    """
+    Submit a frame to display. A pending frame is replaced, i.e. the latest frame wins and the writes to cells
+    changed by both frames are merged.
+    Parameter:
+    frame - frame to display
+    calls - number of bricklet calls if the line items would have been written one by one
+    priority - job priority
+    """
+    def submit_frame(self, frame, calls, priority=PRIORITYNORMAL):
+        with self.condition:
+            pending = self.jobs.get("frame")
+            if pending is not None:
+                # The writes of the replaced frame are skipped
+                self.writesSkipped += pending[2][1]
+        self.submit("frame", self.write_frame, frame, calls, priority=priority)
+
+    """
+    Count bricklet writes skipped without submitting a frame.
+    """
+    def count_skipped(self, calls):
+        with self.condition:
+            self.writesSkipped += calls
+        self.metrics.count("skipped", calls)
+
+    """
+    Replay the display state, i.e. the display content is lost due to a reconnect or bricklet restart.
+    Called by LCDConnection.
+    """
+    def invalidate(self):
+        with self.condition:
+            self.replay = True
+            self.condition.notify()
+
+    """
+    Check if the writer is idle, i.e. no job pending or being written and no replay pending.
+    """
+    def is_idle(self):
+        with self.condition:
+            return not self.jobs and not self.busy and not self.replay
+
+    """
+    Stop the thread. Pending jobs are not written.
+    """
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.join(WRITERSTOPTIMEOUT)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.jobs and not self.replay and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+            # Connect if required. If not connected, wait for the next attempt while jobs are coalesced.
+            if not self.connection.ensure_connected():
+                with self.condition:
+                    if not self.stopped:
+                        self.condition.wait(self.connection.get_retry_delay())
+                continue
+            if self.replay:
+                # Seed the cached config prior replaying, i.e. the config kept by the bricklet is not set again
+                self.read_config()
+            with self.condition:
+                if self.replay:
+                    self.replay_state()
+                if not self.jobs:
+                    continue
+                # Wait for the call budget, pending jobs are coalesced meanwhile
+                delay = self.get_budget_delay()
+                if delay > 0:
+                    self.throttled += 1
+                    self.metrics.count("throttled")
+                    self.condition.wait(delay)
+                    continue
+                # Highest priority first, min() returns the first (oldest) of the jobs with the same priority
+                key = min(self.jobs, key=lambda key: self.jobs[key][3])
+                submitted, function, args, priority = self.jobs.pop(key)
+                self.busy = True
+            try:
+                function(*args)
+            except Exception as e:
+                Domoticz.Error("LCDWriter: Job %s failed (%s)." % (key, e) )
+                # The job is written again with the display state replay after the reconnect
+                self.connection.check_connected()
+            latency = time.time() - submitted
+            with self.condition:
+                self.busy = False
+                self.jobsDone += 1
+                self.lastLatency = latency
+                self.maxLatency = max(self.maxLatency, latency)
+                self.totalLatency += latency
+            self.metrics.observe("latency", latency)
+            if self.startTime is not None and not self.jobs:
+                Domoticz.Log("LCDWriter: UID=%s startup jobs written %.0fms after start (%s:%d)." % (self.uid, (time.time() - self.startTime) * 1000, self.connection.host, self.connection.port) )
+                self.startTime = None
+
+    """
+    Submit the display state jobs not pending, with the frame written in full as the display content is not known.
+    Called with the condition locked.
+    """
+    def replay_state(self):
+        self.replay = False
+        self.frame = new_frame()
+        self.chars = {}
+        now = time.time()
+        for key, (function, args, priority) in self.state.items():
+            if key not in self.jobs:
+                self.jobs[key] = (now, function, args, priority)
+        Domoticz.Debug("LCDWriter: Replay display state (%s)" % (",".join(self.state.keys())) )
+
+    """
+    Get the time (seconds) to wait until the call budget allows the next job, 0=no wait.
+    A job is started if at least one call is left. A job with more calls overdraws the budget, which delays the next job.
+    """
+    def get_budget_delay(self):
+        if self.rate <= 0:
+            return 0
+        now = time.time()
+        self.tokens = min(self.tokens + (now - self.tokenTime) * self.rate, WRITERCALLBURST)
+        self.tokenTime = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    """
+    Call a bricklet function. The round trip time is measured and the call is taken from the call budget.
+    """
+    def call(self, function, *args):
+        self.tokens -= 1
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.metrics.observe("rtt", time.perf_counter() - start)
+
+    """
+    Read the bricklet config into the cached config. On failure, the cached config is unknown.
+    Return:
+    True if read
+    """
+    def read_config(self):
+        try:
+            obj = self.call(self.lcdDev.get_config)
+            self.config = {"backlight": self.call(self.lcdDev.is_backlight_on), "cursor": obj.cursor, "blinking": obj.blinking}
+            Domoticz.Debug("LCDWriter: Config %s" % (self.config) )
+            return True
+        except Exception as e:
+            self.config = {"backlight": None, "cursor": None, "blinking": None}
+            Domoticz.Error("LCDWriter: Read config failed (%s)." % (e) )
+            return False
+
+    """
+    Set the bricklet backlight if it differs from the cached config.
+    """
+    def apply_backlight(self, backlight):
+        if self.config["backlight"] == backlight:
+            self.count_skipped(1)
+            return
+        self.config["backlight"] = None
+        if backlight:
+            self.call(self.lcdDev.backlight_on)
+        else:
+            self.call(self.lcdDev.backlight_off)
+        self.config["backlight"] = backlight
+
+    """
+    Set the bricklet cursor and blinking by a single set_config if it differs from the cached config.
+    """
+    def apply_config(self, cursor, blinking):
+        if self.config["cursor"] == cursor and self.config["blinking"] == blinking:
+            self.count_skipped(1)
+            return
+        self.config["cursor"] = None
+        self.call(self.lcdDev.set_config, cursor, blinking)
+        self.config["cursor"] = cursor
+        self.config["blinking"] = blinking
+
+    """
+    Upload a custom character to the bricklet if not already uploaded.
+    """
+    def apply_custom_character(self, id, char):
+        if self.chars.get(id) == char:
+            self.count_skipped(1)
+            return
+        self.chars.pop(id, None)
+        self.call(self.lcdDev.set_custom_character, id, char)
+        self.chars[id] = char
+
+    """
+    Submit a config check if the CONFIGCHECKINTERVAL has passed. Called by the plugin heartbeat.
+    """
+    def schedule_config_check(self):
+        if CONFIGCHECKINTERVAL > 0 and time.time() >= self.nextConfigCheck:
+            self.nextConfigCheck = time.time() + CONFIGCHECKINTERVAL
+            self.submit("configcheck", self.check_config)
+
+    """
+    Check if the bricklet config matches the cached config. On drift, the config is set again.
+    """
+    def check_config(self):
+        cached = dict(self.config)
+        if self.read_config() and self.config != cached:
+            self.configDrifts += 1
+            Domoticz.Log("LCDWriter: Config drift detected (Cached=%s,Bricklet=%s). Config set again." % (cached, self.config) )
+            with self.condition:
+                for key in ("backlight", "config"):
+                    if key in self.state and key not in self.jobs:
+                        function, args, priority = self.state[key]
+                        self.jobs[key] = (time.time(), function, args, priority)
+
+    """
+    Write the frame changes to the bricklet.
+    Only the changed spans compared to the shadow framebuffer are written.
+    If the new frame is fully known, clearing the display first is used if this requires less writes.
+    Parameter:
+    frame - frame to display
+    calls - number of bricklet calls if the line items would have been written one by one
+    """
+    def write_frame(self, frame, calls):
+        spans = diff_frame(self.frame, frame)
+        clearspans = diff_frame(new_frame(" "), frame) if is_frame_known(frame) else None
+        sent = len(spans)
+        try:
+            if clearspans is not None and len(clearspans) + 1 < len(spans):
+                self.call(self.lcdDev.clear_display)
+                spans = clearspans
+                sent = len(spans) + 1
+            for line, position, text in spans:
+                self.call(self.lcdDev.write_line, line, position, text)
+            self.frame = frame
+        except:
+            # The display content is not known anymore
+            self.frame = new_frame()
+            raise
+        self.count_skipped(max(calls - sent, 0))
+        self.metrics.observe("calls", sent)
+
+    """
+    Get the writer status (queue depth, latency, counters) as text.
+    """
+    def get_status(self):
+        with self.condition:
+            average = self.totalLatency / self.jobsDone if self.jobsDone > 0 else 0.0
+            return "LCDWriter: Depth=%d,MaxDepth=%d,Done=%d,Coalesced=%d,Dropped=%d,Throttled=%d,WritesSkipped=%d,ConfigDrifts=%d,Latency=%.3fs,AvgLatency=%.3fs,MaxLatency=%.3fs" % (len(self.jobs), self.maxDepth, self.jobsDone, self.jobsCoalesced, self.jobsDropped, self.throttled, self.writesSkipped, self.configDrifts, self.lastLatency, average, self.maxLatency)
 
 #
 # Buttons
 #
 
-def set_button_device_state(button, state):
-    Domoticz.Debug("set_button_device_state: Button %d to State %d" % (button,state) )
-    # Get the button id 0-3 and assign to the button unit 9-12 (see top under constants)
-    buttonUnit = button + UNITBUTTON0
+def set_button_device_state(self, display, button, state):
+    Domoticz.Debug("set_button_device_state: Display %d Button %d to State %d" % (display.index,button,state) )
+    # Get the button id 0-3 and assign to the button unit 5-8 of the display (see top under constants)
+    buttonUnit = display.unit(button + UNITBUTTON0)
     # Switch the Domoticz Button Device ON (=1) or OFF (=0)
     try:
-        Devices[buttonUnit].Update(nValue=state,sValue="")
+        update_device(self, buttonUnit, state, "", coalesce=False)
         Domoticz.Debug("set_button_device_state: OK for Button %s (%d)" % (Devices[buttonUnit].Name,Devices[buttonUnit].ID) )
     except:
         Domoticz.Error("set_button_device_state: OK for Button %s (%d)" % (Devices[buttonUnit].Name,Devices[buttonUnit].ID) )
 
-# Callback function for button pressed callback
-def onButtonPressedCallback(button):
-    Domoticz.Debug("Button Pressed: " + str(button))
-    set_button_device_state(button, 1)
+"""
+Trigger a derived button event (long press, double press, hold repeat) by switching the Push On button unit on.
+Parameter:
+display - LCDDisplay
+unit - UNITBUTTONLONG0, UNITBUTTONDOUBLE0 or UNITBUTTONREPEAT0
+button - button 0-3
+"""
+def set_button_event(display, unit, button):
+    unit = display.unit(unit + button)
+    Domoticz.Debug("set_button_event: Unit %d for Button %d" % (unit,button) )
+    try:
+        # Not by update_device: each event must switch the Push On device, even if already On
+        Devices[unit].Update(nValue=1,sValue="On")
+    except:
+        Domoticz.Error("set_button_event: Failed for Unit %d" % (unit) )
+
+"""
+Handle the button events appended by the button callbacks. Called by the heartbeat, i.e. on the plugin thread.
+Debounce on the trailing edge: the edges of a button less than BUTTONDEBOUNCE apart are a burst (bounce), the state of its
+last edge is taken once no edge followed for BUTTONDEBOUNCE. A burst not yet stable is kept for the next heartbeat.
+The edges of a button since the last heartbeat are coalesced: the button device is switched on once if pressed
+and switched off if released at the end, i.e. a bouncing or rapid press results in max 2 device updates.
+Derived events, each triggering its own Push On button unit:
+Long press - pressed for BUTTONLONGPRESS.
+Double press - pressed again within BUTTONDOUBLEPRESS after a short press.
+Hold repeat - every BUTTONREPEAT while held after a long press.
+"""
+def handle_button_events(self):
+    now = time.time()
+    # Raw edges (state, time) per button, not yet debounced
+    while len(self.buttonEvents) > 0:
+        index, button, state, t = self.buttonEvents.popleft()
+        b = self.displays[index].buttons.setdefault(button, {"state": 0, "raw": [], "pressed": None, "long": False, "repeat": 0, "click": None, "double": False})
+        b["raw"].append((state, t))
+    # Edges per display and button: (display, button) -> list of states
+    edges = {}
+    for display in self.displays:
+        for button, b in display.buttons.items():
+            for state, t in debounce_button_edges(self, b, now):
+                # The stable state of a burst not changing the state is bounce
+                if state == b["state"]:
+                    self.buttonEventsDropped += 1
+                    continue
+                b["state"] = state
+                edges.setdefault((display, button), []).append(state)
+                handle_button_edge(display, button, b, state, t)
+    # Coalesced button device updates
+    for (display, button), states in edges.items():
+        if 1 in states:
+            set_button_device_state(self, display, button, 1)
+        if states[-1] == 0:
+            set_button_device_state(self, display, button, 0)
+        self.buttonEventsCoalesced += len(states) - (1 if 1 in states else 0) - (1 if states[-1] == 0 else 0)
+    # Long press and hold repeat of the buttons held
+    for display in self.displays:
+        for button, b in display.buttons.items():
+            if b["pressed"] is None:
+                continue
+            if not b["long"] and now - b["pressed"] >= BUTTONLONGPRESS:
+                b["long"] = True
+                set_button_event(display, UNITBUTTONLONG0, button)
+            if b["long"] and now >= b["repeat"]:
+                # Repeats missed since the last heartbeat are coalesced
+                missed = int((now - b["repeat"]) / BUTTONREPEAT)
+                self.buttonEventsCoalesced += missed
+                b["repeat"] += (missed + 1) * BUTTONREPEAT
+                set_button_event(display, UNITBUTTONREPEAT0, button)
+
+"""
+Debounce the raw edges of a button: the edges less than BUTTONDEBOUNCE apart are a burst. A burst is stable if no edge
+followed for BUTTONDEBOUNCE. The raw edges of a burst not yet stable are kept in the button state.
+Parameter:
+b - button state (see handle_button_events)
+now - time
+Return:
+list of (state, time) per stable burst: the state of the last edge and the time of the first edge of the burst
+"""
+def debounce_button_edges(self, b, now):
+    stable = []
+    start = None
+    for index, (state, t) in enumerate(b["raw"]):
+        if start is None:
+            start = index
+        elif t - b["raw"][index - 1][1] >= BUTTONDEBOUNCE:
+            stable.append((b["raw"][index - 1][0], b["raw"][start][1]))
+            start = index
+    if start is not None and now - b["raw"][-1][1] >= BUTTONDEBOUNCE:
+        stable.append((b["raw"][-1][0], b["raw"][start][1]))
+        start = None
+    # The edges of the bursts taken but not the last edge are bounce
+    dropped = len(b["raw"]) - len(stable) - (len(b["raw"]) - start if start is not None else 0)
+    self.buttonEventsDropped += dropped
+    b["raw"] = b["raw"][start:] if start is not None else []
+    return stable
+
+"""
+Handle a debounced button edge: the derived events double press (on press) and long press (on release).
+Parameter:
+display - LCDDisplay
+button - button 0-3
+b - button state (see handle_button_events)
+state - 1=pressed, 0=released
+t - time of the edge
+"""
+def handle_button_edge(display, button, b, state, t):
+    if state == 1:
+        b["pressed"] = t
+        b["long"] = False
+        b["repeat"] = t + BUTTONLONGPRESS + BUTTONREPEAT
+        # Second press of a double press
+        b["double"] = b["click"] is not None and t - b["click"] <= BUTTONDOUBLEPRESS
+        b["click"] = None
+        if b["double"]:
+            set_button_event(display, UNITBUTTONDOUBLE0, button)
+    else:
+        duration = t - b["pressed"] if b["pressed"] is not None else 0
+        b["pressed"] = None
+        if duration >= BUTTONLONGPRESS and not b["long"]:
+            b["long"] = True
+            set_button_event(display, UNITBUTTONLONG0, button)
+        # A short press can be the first press of a double press
+        b["click"] = t if duration < BUTTONLONGPRESS and not b["double"] else None
+
+# Callback function for button pressed callback (called by the Tinkerforge callback thread)
+# The event is handled by the heartbeat on the plugin thread (see handle_button_events)
+# The display index is bound when the callback is registered (see onStart)
+def onButtonPressedCallback(display, button):
+    _plugin.buttonEvents.append((display, button, 1, time.time()))
+    if _plugin.trace is not None:
+        _plugin.trace.record("button", display, button, 1)
+    # The backlight is switched on right away, not by the next heartbeat
+    wake_backlight(_plugin, _plugin.displays[display], True)
 
-# Callback function for button released callback
-def onButtonReleasedCallback(button):
-    Domoticz.Debug("Button Released: " + str(button))
-    set_button_device_state(button, 0)
+# Callback function for button released callback (called by the Tinkerforge callback thread)
+def onButtonReleasedCallback(display, button):
+    _plugin.buttonEvents.append((display, button, 0, time.time()))
+    if _plugin.trace is not None:
+        _plugin.trace.record("button", display, button, 0)
 
 ##
 # Generic helper functions
@@ -58,8 +58,8 @@ return {
 
         -- The time is displayed line 0 at the right with special character time symbol (index 1 = \u0009)
         local line3 = string.format('{"line":0,"position":14,"clear":1,"text":"\\u0009%s"}', isnowhhmm(domoticz) )
-        -- To display degree C use the unicode hex value for ° character which is \u00DF (see LCD character table)
-        local line0 = string.format('{"line":1,"position":0,"clear":1,"text":"CPU  %s  \\u00DFC"}', cputemp )
+        -- To display degree C use the unicode ° character \u00B0, translated by the plugin to the LCD character table
+        local line0 = string.format('{"line":1,"position":0,"clear":1,"text":"CPU  %s  \\u00B0C"}', cputemp )
         -- The % character needs to be escaped with % to %%
         local line1 = string.format('{"line":2,"position":0,"clear":1,"text":"RAM  %s %%"}', ramusage )
         local line2 = string.format('{"line":3,"position":0,"clear":1,"text":"DISC %s %%"}', discusage )